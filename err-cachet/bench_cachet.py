@@ -0,0 +1,379 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""Startup and commands benchmark against a local mock Cachet server
+
+Run with::
+
+    py.test -s bench_cachet.py
+
+Environment variables:
+
+    BENCH_SIZES         Comma separated incidents counts (100,10000,100000)
+    BENCH_COMPONENTS    Number of components (200)
+    BENCH_GROUPS        Number of component groups (20)
+    BENCH_ITERATIONS    Runs of each command (20)
+    BENCH_LATENCY       Mock server latency in milliseconds (0)
+"""
+
+import os
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+pytest_plugins = ["errbot.backends.test"]
+extra_plugin_dir = '.'
+
+SIZES = [int(size) for size in
+         os.environ.get('BENCH_SIZES', '100,10000,100000').split(',')]
+COMPONENTS = int(os.environ.get('BENCH_COMPONENTS', 200))
+GROUPS = int(os.environ.get('BENCH_GROUPS', 20))
+ITERATIONS = int(os.environ.get('BENCH_ITERATIONS', 20))
+LATENCY = float(os.environ.get('BENCH_LATENCY', 0)) / 1000
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+API_PREFIX = '/api/v1'
+
+# Run in a fresh interpreter, errbot is already imported by the bot
+STARTUP_SCRIPT = """
+import sys
+import time
+from unittest.mock import MagicMock
+import errbot
+started = time.perf_counter()
+import cachet
+plugin = cachet.Cachet(MagicMock(), 'Cachet')
+plugin.configure({'api_endpoint': 'http://127.0.0.1:1/api/v1',
+                  'api_token': 'bench'})
+deferred = time.perf_counter()
+lazy = int('requests' not in sys.modules and 'pylls' not in sys.modules)
+# Startup work without deferral, still cold in this interpreter
+import requests, pylls.cachet, pylls.client
+api_client = pylls.client.CachetAPIClient(
+    api_endpoint='http://127.0.0.1:1/api/v1', api_token='bench')
+pylls.cachet.Components(api_client)
+pylls.cachet.Incidents(api_client)
+eager = time.perf_counter()
+print(deferred - started, eager - started, lazy)
+"""
+
+COMMANDS = [
+    'cachet plugin version',
+    'cachet comp status',
+    'cachet comp list all',
+    'cachet comp list groups',
+    'cachet comp list group 1',
+    'cachet group status',
+    'cachet comp show 1',
+    'cachet comp search storage',
+    'cachet comp set status 1 op',
+    'cachet comp bulk set status 1-10 op',
+    'cachet maint forecast',
+    'cachet maint last',
+    'cachet inci last',
+    'cachet inci last --num 50',
+    'cachet inci show 1',
+    'cachet inci search outage',
+    'cachet inci new invest 1 po "Bench" "Bench incident."',
+    'cachet inci update 1 - - "Bench update."',
+    'cachet inci set component 1 1',
+    'cachet inci rename 1 "Bench incident"',
+    'cachet inci set hidden 1',
+    'cachet inci set visible 1',
+]
+
+STATUS_NAMES = ['Unknown', 'Operational', 'Performance Issues',
+                'Partial Outage', 'Major Outage']
+HUMAN_STATUSES = ['Scheduled', 'Investigating', 'Identified', 'Watching',
+                  'Fixed']
+
+
+def seed(incidents_count, components_count=COMPONENTS,
+         groups_count=GROUPS):
+    """Build mock Cachet data
+
+    :return: :func:`dict` of entries lists by endpoint
+    """
+    rand = random.Random(incidents_count)
+    start = datetime(2015, 1, 1)
+    now = datetime.now()
+    span = (now - start).total_seconds()
+
+    def date(offset):
+        return (start + timedelta(seconds=offset)).strftime(DATE_FORMAT)
+
+    groups = [{'id': gid, 'name': 'Group %d' % gid, 'order': gid,
+               'collapsed': 0,
+               'created_at': date(0), 'updated_at': date(0)}
+              for gid in range(1, groups_count + 1)]
+    components = []
+    for cid in range(1, components_count + 1):
+        status = rand.choice([1, 1, 1, 1, 2, 3, 4])
+        components.append({
+            'id': cid, 'name': 'Storage %s %d' % (
+                rand.choice(['NAS', 'SAN', 'Object']), cid),
+            'description': 'Benchmark component %d' % cid, 'link': '',
+            'status': str(status), 'status_name': STATUS_NAMES[status],
+            'order': cid, 'group_id': cid % groups_count + 1,
+            'enabled': True, 'deleted_at': None,
+            'created_at': date(0), 'updated_at': date(cid)})
+    incidents = []
+    for iid in range(1, incidents_count + 1):
+        created = date(span * iid / (incidents_count + 1))
+        status = 0 if rand.random() < 0.1 else rand.randint(1, 4)
+        scheduled = date(span * rand.random() + 30 * 86400)
+        incidents.append({
+            'id': iid, 'name': 'Incident %d %s' % (
+                iid, rand.choice(['outage', 'slowness', 'maintenance'])),
+            'message': 'Benchmark incident %d.\n' % iid * 5,
+            'status': str(status), 'human_status': HUMAN_STATUSES[status],
+            'component_id': str(rand.randint(0, components_count)),
+            'visible': 1, 'deleted_at': None,
+            'scheduled_at': scheduled if status == 0 else created,
+            'created_at': created, 'updated_at': created})
+    return {'components/groups': groups, 'components': components,
+            'incidents': incidents}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server"""
+    daemon_threads = True
+
+
+class MockCachet(object):
+    """Local HTTP stand-in for Cachet API
+
+    Lists are paginated and accept ``sort``, ``order``, ``per_page`` and
+    exact match filters as Cachet does. Requests are counted by method and
+    endpoint.
+
+    :param dict data: Entries by endpoint as returned by :func:`seed`
+    :param float latency: Latency added to each request in seconds
+    """
+
+    def __init__(self, data, latency=0):
+        """Init method"""
+        self.data = data
+        self.latency = latency
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Mock API request handler"""
+
+            def log_message(self, *args):
+                """Silence requests logging"""
+
+            def do_GET(self):
+                mock.handle(self, 'GET')
+
+            def do_POST(self):
+                mock.handle(self, 'POST')
+
+            def do_PUT(self):
+                mock.handle(self, 'PUT')
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint = 'http://127.0.0.1:%d%s' % (self.server.server_port,
+                                                   API_PREFIX)
+
+    def start(self):
+        """Start serving in background"""
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+
+    def stop(self):
+        """Stop serving"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def route(self, path):
+        """Get endpoint and entry ID of a request path"""
+        path = path[len(API_PREFIX):].strip('/')
+        for endpoint in ('components/groups', 'components', 'incidents'):
+            if path == endpoint:
+                return endpoint, None
+            if path.startswith(endpoint + '/'):
+                return endpoint, int(path[len(endpoint) + 1:])
+        return path, None
+
+    def handle(self, request, method):
+        """Handle a mock API request"""
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(request.path)
+        length = int(request.headers.get('Content-Length') or 0)
+        try:
+            params = json.loads(request.rfile.read(length) or '{}')
+        except ValueError:
+            params = {}
+        params.update({key: values[-1]
+                       for key, values in parse_qs(url.query).items()})
+        endpoint, entry_id = self.route(url.path)
+        with self.lock:
+            self.requests[(method, endpoint)] += 1
+            status, payload = self.respond(method, endpoint, entry_id,
+                                           params)
+        body = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def respond(self, method, endpoint, entry_id, params):
+        """Build mock API response"""
+        if endpoint in ('ping', 'version'):
+            return 200, {'data': 'Pong!' if endpoint == 'ping' else '2.3.10'}
+        entries = self.data.get(endpoint)
+        if entries is None:
+            return 404, {'errors': []}
+
+        if entry_id is not None:
+            if not 0 < entry_id <= len(entries):
+                return 404, {'errors': []}
+            entry = entries[entry_id - 1]
+            if method == 'PUT':
+                entry.update({key: str(value) if key == 'status' else value
+                              for key, value in params.items()
+                              if key in entry})
+                entry['updated_at'] = datetime.now().strftime(DATE_FORMAT)
+            return 200, {'data': entry}
+
+        if method == 'POST':
+            entry = dict(entries[0], **params)
+            entry['id'] = len(entries) + 1
+            entry['status'] = str(entry['status'])
+            entry['created_at'] = datetime.now().strftime(DATE_FORMAT)
+            entry['updated_at'] = entry['created_at']
+            entries.append(entry)
+            return 200, {'data': entry}
+        return 200, self.paginate(endpoint, entries, params)
+
+    def paginate(self, endpoint, entries, params):
+        """Filter, sort and paginate a list"""
+        per_page = int(params.pop('per_page', 20))
+        page = int(params.pop('page', 1))
+        sort = params.pop('sort', 'id')
+        reverse = params.pop('order', 'asc') == 'desc'
+        for key, value in params.items():
+            entries = [entry for entry in entries
+                       if str(entry.get(key)) == str(value)]
+        entries = sorted(entries, key=lambda entry: entry[sort],
+                         reverse=reverse)
+        total = len(entries)
+        last_page = max(1, -(-total // per_page))
+        next_page = None
+        if page < last_page:
+            next_page = '%s/%s?page=%d' % (self.endpoint, endpoint, page + 1)
+        return {
+            'data': entries[(page - 1) * per_page:page * per_page],
+            'meta': {'pagination': {
+                'total': total, 'count': per_page, 'per_page': per_page,
+                'current_page': page, 'total_pages': last_page,
+                'links': {'next_page': next_page}}}}
+
+
+def percentile(values, ratio):
+    """Get percentile of a list of values"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def test_bench_startup():
+    """Benchmark plugin startup with deferred and eager imports
+
+    Eager startup adds the imports and client construction deferred to
+    the first API call, timed cold in the same interpreter.
+    """
+    env = dict(os.environ)
+    env.pop('TEST_API', None)
+    deferred, eager = [], []
+    for _ in range(ITERATIONS):
+        output = subprocess.check_output(
+            [sys.executable, '-c', STARTUP_SCRIPT], env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        lazy_startup, eager_startup, lazy = output.split()
+        assert lazy == b'1', "HTTP client imported by plugin startup"
+        deferred.append(float(lazy_startup) * 1000)
+        eager.append(float(eager_startup) * 1000)
+
+    print("\n%-40s %9s %9s %9s" % ('startup', 'p50 ms', 'p95 ms',
+                                    'max ms'))
+    for step, latencies in (('deferred imports', deferred),
+                            ('eager imports and client', eager)):
+        print("%-40s %9.1f %9.1f %9.1f" % (
+            step, percentile(latencies, 0.5), percentile(latencies, 0.95),
+            max(latencies)))
+
+
+@pytest.fixture(params=SIZES, ids=['%d_incidents' % size for size in SIZES])
+def cachet_server(request):
+    """Mock Cachet server seeded with benchmark data"""
+    server = MockCachet(seed(request.param), latency=LATENCY)
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_bench_commands(testbot, cachet_server):
+    """Benchmark every command against the mock Cachet server"""
+    os.environ.pop('TEST_API', None)
+    testbot.push_message('!plugin config Cachet %s' % str({
+        'api_endpoint': cachet_server.endpoint, 'api_token': 'bench'}))
+    assert 'Plugin configuration done.' in testbot.pop_message()
+
+    size = len(cachet_server.data['incidents'])
+    print("\n%d incidents, %d components, %d iterations" % (
+        size, len(cachet_server.data['components']), ITERATIONS))
+    print("%-40s %9s %9s %9s %9s %9s" % (
+        'command', 'p50 ms', 'p95 ms', 'max ms', 'req/run', 'peak KiB'))
+
+    tracemalloc.start()
+    for command in COMMANDS:
+        latencies = []
+        requests_before = sum(cachet_server.requests.values())
+        peak = 0
+        for _ in range(ITERATIONS):
+            tracemalloc.reset_peak()
+            started = time.perf_counter()
+            testbot.push_message('!' + command)
+            testbot.pop_message(timeout=120)
+            latencies.append((time.perf_counter() - started) * 1000)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        requests_count = (sum(cachet_server.requests.values()) -
+                          requests_before)
+        print("%-40s %9.1f %9.1f %9.1f %9.1f %9d" % (
+            command[7:47], percentile(latencies, 0.5),
+            percentile(latencies, 0.95), max(latencies),
+            requests_count / ITERATIONS, peak / 1024))
+    tracemalloc.stop()
@@ -19,21 +19,79 @@
 #    along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import requests
+from itertools import chain, islice, takewhile
+from threading import Lock, Thread
 from errbot import BotPlugin, botcmd, arg_botcmd
 from . import utils
+from .backends import CACHE_BACKENDS, SQLiteBackend, StorageBackend
+from .cache import (RenderCache, SnapshotCache, UpdateLogCache,
+                    VersionedFetch)
+from .executor import MutationQueue, RequestBatch
+from .index import (REBUILD_PAGE_SIZE, IncidentIndex, is_active,
+                    is_scheduled, match_incident)
+from .models import Component, ComponentGroup, Incident, IncidentUpdate
+from .rollup import GroupStatus, rollup
+from .search import ComponentSearchIndex, match_text
+from .stats import Stats, timed
+from .updates import UPDATES_VERSION, parse_version, update_log
 from .resources import views
-from pylls import cachet, client, tests
+
+# Imported on first API call only, see Cachet.connect
+requests = utils.LazyModule('requests')
+cachet = utils.LazyModule('pylls.cachet')
+client = utils.LazyModule('pylls.client')
 
 VERSION = '0.2.0'
 
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 CACHET_TITLE = 'Status page service'
 CACHET_LINK = 'http://status.domain.tld'
 
+# Card body size limit for backends missing from card_max_sizes setting
+CARD_MAX_SIZE = 4000
+
+# ID ranges of bulk commands are limited to this many times the number
+# of components
+RANGE_SPAN_FACTOR = 10
+
+# Seconds components and groups lists are reused while their version
+# probe reports no change
+VERSIONED_MAX_AGE = 300
+
+# Minimal seconds between incident index saves, rebuilds excepted
+INDEX_SAVE_INTERVAL = 600
+
+# Seconds waited for acknowledged incident updates on deactivation
+WRITES_TIMEOUT = 30
+
+# Optional settings and their default values
+CONFIG_DEFAULTS = {'cache_ttl': 30,
+                   'index_rebuild_interval': 3600,
+                   'max_workers': 8,
+                   'http_pool_size': 10,
+                   'http_connect_timeout': 5,
+                   'http_read_timeout': 15,
+                   'http_retries': 3,
+                   'http_backoff_factor': 0.5,
+                   'http_rate_limit': 0,
+                   'http_rate_burst': 0,
+                   'circuit_threshold': 5,
+                   'circuit_cooldown': 30,
+                   'stale_budget': 3,
+                   'poll_interval': 0,
+                   'poll_rooms': [],
+                   'status_aliases': {'incident': {}, 'component': {}},
+                   'card_max_sizes': {'slack': 3000,
+                                      'default': CARD_MAX_SIZE},
+                   'cache_backend': 'memory',
+                   'cache_path': ''}
+
 CONFIG_TEMPLATE = {'api_endpoint': "http://status.domain.tld/api/v1",
                    'api_token': "XXXXXXXXXXXXXXXXXXXX"}
+CONFIG_TEMPLATE.update(CONFIG_DEFAULTS)
 
 
 class Cachet(BotPlugin):
@@ -41,9 +99,27 @@ class Cachet(BotPlugin):
 
     def __init__(self, bot, name=None):
         """Init method"""
-        self._cachet_client = None
-        self._components = None
-        self._incidents = None
+        self._api = None
+        self._api_lock = Lock()
+        self._cache = None
+        self._fetch_components = None
+        self._fetch_groups = None
+        self._executor = None
+        self._incident_index = None
+        self._index_lock = Lock()
+        self._index_builder = None
+        self._index_changed = False
+        self._index_saved_at = 0
+        self._updates = None
+        self._statuses = None
+        self._istatus = utils.INCIDENT_STATUS
+        self._cstatus = utils.COMPONENT_STATUS
+        self._search_index = (None, None)
+        self._rollup = (None, None)
+        self._renders = RenderCache()
+        self._update_logs = UpdateLogCache()
+        self._cachet_version = None
+        self.stats = Stats()
         super().__init__(bot, name)
 
     @staticmethod
@@ -60,7 +136,7 @@ class Cachet(BotPlugin):
             config = {'api_endpoint': os.environ.get("cachet_api_endpoint"),
                       'api_token': os.environ.get("cachet_api_token")}
 
-        super().configure(config)
+        super().configure(dict(CONFIG_DEFAULTS, **config))
 
     @staticmethod
     def check_configuration(config):
@@ -69,6 +145,15 @@ class Cachet(BotPlugin):
             raise Exception("api_token must be specified.")
         if "api_endpoint" not in config:
             raise Exception("api_endpoint must be specified.")
+        aliases = config.get('status_aliases') or {}
+        try:
+            utils.INCIDENT_STATUS.extend(aliases.get('incident') or {})
+            utils.COMPONENT_STATUS.extend(aliases.get('component') or {})
+        except ValueError as exc:
+            raise Exception(str(exc))
+        if config.get('cache_backend', 'memory') not in CACHE_BACKENDS:
+            raise Exception("cache_backend must be one of: %s." %
+                            ", ".join(CACHE_BACKENDS))
 
     def activate(self):
         """Activate the plugin"""
@@ -77,222 +162,892 @@ class Cachet(BotPlugin):
             self.log.info('Cachet plugin is not configured. Abort activation.')
             return
 
-        api_endpoint = self.config["api_endpoint"]
-        api_token = self.config["api_token"]
-        self.log.debug("Cachet API endpoint: %s" % api_endpoint)
-        self.log.debug("Cachet API token: %s" % api_token)
+        self.log.debug("Cachet API endpoint: %s" % self.config["api_endpoint"])
+        self.log.debug("Cachet API token: %s" % self.config["api_token"])
+        # API client is built on first use, with the current configuration
+        self._api = None
+
+        aliases = self.config['status_aliases'] or {}
+        self._istatus = utils.INCIDENT_STATUS.extend(
+            aliases.get('incident') or {})
+        self._cstatus = utils.COMPONENT_STATUS.extend(
+            aliases.get('component') or {})
+
+        backend = self.build_cache_backend()
+        self._cache = SnapshotCache(
+            ttl=self.config['cache_ttl'], backend=backend,
+            budget=self.config['stale_budget'] or None,
+            fallback=backend or StorageBackend(self))
+        self._fetch_components = VersionedFetch(
+            lambda: self.list_version('components'),
+            lambda: [Component.from_api(data)
+                     for data in self._components.get()],
+            max_age=VERSIONED_MAX_AGE)
+        self._fetch_groups = VersionedFetch(
+            lambda: self.list_version('components/groups'),
+            lambda: [ComponentGroup.from_api(data)
+                     for data in self._components.groups.get()],
+            max_age=VERSIONED_MAX_AGE)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.config['max_workers'])
+        self._updates = MutationQueue(self._executor,
+                                      self._write_incident_updates,
+                                      self._incident_updates_failed)
+
+        super().activate()
+
+        if self.config['poll_interval'] and self.config['poll_rooms']:
+            self.start_poller(self.config['poll_interval'],
+                              self.poll_components)
+
+    def deactivate(self):
+        """Deactivate the plugin"""
+        if self._updates is not None:
+            # Acknowledged updates are written before leaving
+            if not self._updates.join(WRITES_TIMEOUT):
+                self.log.warning("Pending incident updates are dropped")
+        if self._incident_index is not None:
+            self.save_incident_index(self._incident_index)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._api is not None:
+            self._api[0].r_session.close()
+            self._api = None
+        super().deactivate()
+
+    def build_cache_backend(self):
+        """Build snapshots backend shared with other bot instances
+
+        :return: Backend instance or :obj:`None` for process memory
+        """
+        backend = self.config['cache_backend']
+        if backend == 'sqlite':
+            path = self.config['cache_path'] or os.path.join(
+                self.bot_config.BOT_DATA_DIR, 'cachet_cache.sqlite')
+            return SQLiteBackend(path)
+        if backend == 'storage':
+            return StorageBackend(self)
+        return None
+
+    def connect(self):
+        """Build Cachet API client and resources on first use
+
+        pylls and requests are only imported here, the mock API is used
+        when ``TEST_API`` environment variable is set.
+
+        :return: :func:`tuple` (API client, components, incidents)
+        """
+        with self._api_lock:
+            if self._api is not None:
+                return self._api
+            if os.environ.get('TEST_API'):
+                from pylls import tests
+                api_client = tests.test_api.api_client()
+            else:
+                from .transport import build_session
+                api_client = client.CachetAPIClient(
+                    api_endpoint=self.config["api_endpoint"],
+                    api_token=self.config["api_token"],
+                    timeout=(self.config['http_connect_timeout'],
+                             self.config['http_read_timeout'])
+                )
+                api_client.r_session = build_session(
+                    pool_size=self.config['http_pool_size'],
+                    retries=self.config['http_retries'],
+                    backoff_factor=self.config['http_backoff_factor'],
+                    stats=self.stats,
+                    rate_limit=self.config['http_rate_limit'],
+                    rate_burst=self.config['http_rate_burst'],
+                    circuit_threshold=self.config['circuit_threshold'],
+                    circuit_cooldown=self.config['circuit_cooldown'])
+            self._api = (api_client,
+                         cachet.Components(api_client),
+                         cachet.Incidents(api_client))
+            return self._api
+
+    @property
+    def _cachet_client(self):
+        """Cachet API client"""
+        return self.connect()[0]
+
+    @property
+    def _components(self):
+        """Cachet components API"""
+        return self.connect()[1]
+
+    @property
+    def _incidents(self):
+        """Cachet incidents API"""
+        return self.connect()[2]
+
+    def cachet_version(self):
+        """Get Cachet version, requested once
+
+        :return: :func:`tuple` (major, minor), (0, 0) while unknown
+        """
+        if self._cachet_version is None:
+            try:
+                version = cachet.Version(self._cachet_client).get()
+            except requests.exceptions.RequestException as exc:
+                self.log.warning("Cachet version is unknown: %s" % exc)
+                return (0, 0)
+            self._cachet_version = parse_version(version)
+        return self._cachet_version
+
+    def has_incident_updates(self):
+        """Tell if Cachet API lists incident updates (Cachet 2.4)
+
+        :return: :obj:`True` if incident updates endpoint is available
+        """
+        return self.cachet_version() >= UPDATES_VERSION
+
+    def list_version(self, path):
+        """Get version of an API list
+
+        Only the last updated entry is requested, its update date and the
+        list size change whenever an entry is added, updated or removed.
+
+        :param str path: API list path
+        :return: :func:`tuple` (entries count, last update date)
+        """
+        response = self._cachet_client.get(path, data={
+            'per_page': 1, 'sort': 'updated_at', 'order': 'desc'})
+        entries = response.get('data') or []
+        try:
+            total = response['meta']['pagination']['total']
+        except (KeyError, TypeError):
+            total = None
+        return total, entries[0]['updated_at'] if entries else None
+
+    def get_components(self):
+        """Get components snapshot
+
+        :return: :class:`~cachet.models.Component` records (:func:`list`)
+        """
+        return self._cache.get('components', self._fetch_components,
+                               model=Component)
+
+    def get_groups(self):
+        """Get component groups snapshot
+
+        :return: :class:`~cachet.models.ComponentGroup` records
+                 (:func:`list`)
+        """
+        return self._cache.get('groups', self._fetch_groups,
+                               model=ComponentGroup)
+
+    def get_component(self, cid):
+        """Get component from snapshot
+
+        Components missing from the snapshot are requested to the API,
+        so recently created components are still reachable.
+
+        :param cid: Component ID
+        :return: :class:`~cachet.models.Component`
+        :raise: :class:`requests.exceptions.HTTPError` if component is unknown
+        """
+        cid = int(cid)
+        for component in self.get_components():
+            if component.id == cid:
+                return component
+        return utils.first(map(Component.from_api,
+                               self._components.get(cid)))
+
+    def get_search_index(self):
+        """Get components search index, rebuilt on snapshot change
+
+        :return: :class:`~cachet.search.ComponentSearchIndex`
+        """
+        components = self.get_components()
+        snapshot, index = self._search_index
+        if snapshot is not components:
+            index = ComponentSearchIndex(components)
+            self._search_index = (components, index)
+        return index
+
+    def get_rollup(self):
+        """Get component groups health, rebuilt on snapshots change
+
+        :return: :class:`~cachet.rollup.GroupStatus` by group ID
+                 (:func:`dict`)
+        """
+        components = self.get_components()
+        groups = self.get_groups()
+        snapshots, statuses = self._rollup
+        if snapshots is None or snapshots[0] is not components or (
+                snapshots[1] is not groups):
+            statuses = rollup(components, groups)
+            self._rollup = ((components, groups), statuses)
+        return statuses
+
+    def invalidate_components(self):
+        """Drop components snapshot after a status change
+
+        Lists versions may miss changes made in the same second, the next
+        snapshot is always fully fetched.
+        """
+        self._fetch_components.reset()
+        self._fetch_groups.reset()
+        self._cache.invalidate('components')
+
+    def get_incident_index(self):
+        """Get incident index, refreshed at most once per cache TTL
+
+        :return: :class:`~cachet.index.IncidentIndex`
+        """
+        return self._cache.get('incidents', self._refresh_incident_index,
+                               shared=False,
+                               restore=self._restore_incident_index)
+
+    def _load_incident_state(self):
+        """Get persisted incident index state
+
+        :return: Index state (:func:`dict`) or :obj:`None`
+        """
+        record = self._cache.fallback.load('incident_index')
+        return record[1] if record else None
+
+    def _restore_incident_index(self):
+        """Get persisted incident index while API is unavailable
+
+        :return: :func:`tuple` (refresh time, index) or :obj:`None`
+        """
+        state = self._load_incident_state()
+        if not state:
+            return None
+        index = IncidentIndex(
+            state, rebuild_interval=self.config['index_rebuild_interval'])
+        with self._index_lock:
+            # Kept for incidents lookups and writes until the API is back
+            if self._incident_index is None:
+                self._incident_index = index
+            index = self._incident_index
+        return index.refreshed_at, index
+
+    def _refresh_incident_index(self):
+        """Incrementally refresh incident index and persist it
+
+        The index is persisted in the cache fallback backend after a
+        rebuild, or at most every ``INDEX_SAVE_INTERVAL`` seconds when it
+        changed. With a shared cache backend, the API is not checked for
+        changes when another instance with the same index watermark just
+        did it.
+        """
+        backend = self._cache.backend
+        index = self._incident_index
+        if index is None:
+            index = IncidentIndex(
+                self._load_incident_state(),
+                rebuild_interval=self.config['index_rebuild_interval'])
+
+        if backend is not None:
+            record = backend.load('incident_watermark')
+            if (record is not None and record[1] == index.watermark and
+                    time.time() - record[0] < self.config['cache_ttl']):
+                self._incident_index = index
+                return index
+
+        if index.refresh(self.fetch_incidents):
+            self._index_changed = True
+        if index.rebuilt_at > self._index_saved_at or (
+                time.time() - self._index_saved_at > INDEX_SAVE_INTERVAL):
+            self.save_incident_index(index)
+        if backend is not None:
+            backend.store('incident_watermark', time.time(), index.watermark)
+        self._incident_index = index
+        return index
+
+    def save_incident_index(self, index):
+        """Persist incident index if it changed since last saved
+
+        :param index: :class:`~cachet.index.IncidentIndex`
+        """
+        if not self._index_changed:
+            return
+        self._index_changed = False
+        self._index_saved_at = time.time()
+        self._cache.fallback.store('incident_index', self._index_saved_at,
+                                   index.dump())
+
+    def start_incident_index(self):
+        """Build incident index in background, unless already building
+
+        The first build downloads the whole incident history, it runs in
+        its own thread so the executor is not blocked meanwhile.
+        """
+        with self._index_lock:
+            builder = self._index_builder
+            if builder is not None and builder.is_alive():
+                return
+            self._index_builder = Thread(target=self._build_incident_index,
+                                         daemon=True)
+            self._index_builder.start()
+
+    def _build_incident_index(self):
+        """Build incident index, errors are logged"""
+        try:
+            self.get_incident_index()
+        except Exception as exc:
+            self.log.warning("Incident index build failed: %s" % exc)
 
-        # Activate mock API of requested
-        if os.environ.get('TEST_API'):
-            self._cachet_client = tests.test_api.api_client()
+    def get_active_incidents(self, cid):
+        """Get active incidents of a component from incident index
+
+        :param cid: Component ID
+        :return: Incidents, newest first (:func:`list`)
+        """
+        return self.get_incident_index().active(cid)
+
+    def fetch_incidents(self, iid=None, **params):
+        """Get incidents from API
+
+        :param iid: Incident ID (optional)
+        :return: :class:`~cachet.models.Incident` records iterator
+
+        Additional named arguments are transmitted to API.
+        """
+        return map(Incident.from_api, self._incidents.get(iid, **params))
+
+    def get_incident(self, iid):
+        """Get incident from API
+
+        Incidents with pending updates are read from their optimistic copy.
+
+        :param iid: Incident ID
+        :return: :class:`~cachet.models.Incident`
+        :raise: :class:`requests.exceptions.HTTPError` if incident is unknown
+        """
+        incident = self._updates.pending(int(iid))
+        if incident is not None:
+            return incident
+        return utils.first(self.fetch_incidents(iid))
+
+    def get_known_incident(self, iid):
+        """Get incident from pending updates or incident index
+
+        The API is only requested for incidents unknown to the index.
+
+        :param iid: Incident ID
+        :return: :class:`~cachet.models.Incident`
+        :raise: :class:`requests.exceptions.HTTPError` if incident is unknown
+        """
+        incident = self._updates.pending(int(iid))
+        if incident is None and self._incident_index is not None:
+            incident = self._incident_index.get(iid)
+        if incident is None:
+            incident = self.get_incident(iid)
+        return incident
+
+    def get_indexed_incident(self, iid):
+        """Get incident from pending updates or incident index only
+
+        Used while the API is unreachable, the persisted index is restored
+        if needed.
+
+        :param iid: Incident ID
+        :return: :func:`tuple` (incident, index refresh UNIX timestamp) or
+                 :obj:`None` if incident is unknown
+        """
+        index = self._incident_index
+        if index is None:
+            try:
+                index = self.get_incident_index()
+            except requests.exceptions.RequestException:
+                return None
+        incident = self._updates.pending(int(iid)) or index.get(iid)
+        if incident is None:
+            return None
+        return incident, index.refreshed_at
+
+    def get_update_log(self, incident):
+        """Get incident update log, loaded once per incident version
+
+        :param incident: :class:`~cachet.models.Incident`
+        :return: :class:`~cachet.models.IncidentUpdate` records, newest
+                 first (:func:`list`)
+        """
+        def load():
+            updates = ()
+            if self.has_incident_updates():
+                updates = map(IncidentUpdate.from_api,
+                              self._cachet_client.paginate_request(
+                                  'incidents/%d/updates' % incident.id,
+                                  'GET'))
+            return update_log(incident, updates)
+
+        version = (incident.updated_at, len(incident.message))
+        return self._update_logs.get(incident.id, version, load)
+
+    def _write_incident_updates(self, iid, updates):
+        """Write queued updates of an incident
+
+        Updates are appended to the incident updates with Cachet 2.4.
+        Otherwise, the incident is requested again and updates are
+        prepended to its current message in a single API request.
+
+        :param int iid: Incident ID
+        :param list updates: Updates queued by :meth:`cachet_inci_update`
+        """
+        params = {'status': updates[-1]['status'],
+                  'component_status': updates[-1]['component_status']}
+        if self.has_incident_updates():
+            for update in updates:
+                self._cachet_client.post('incidents/%d/updates' % iid, data={
+                    'status': update['status'],
+                    'message': update['message']})
+            params['component_id'] = updates[0]['incident'].component_id
         else:
-            self._cachet_client = client.CachetAPIClient(
-                api_endpoint=api_endpoint,
-                api_token=api_token
-            )
+            incident = utils.first(self.fetch_incidents(iid))
+            message = []
+            for update in reversed(updates):
+                message.extend([update['header'], update['message'],
+                                views.updates_separator()])
+            message.append(incident.message)
+            params['component_id'] = incident.component_id
+            params['message'] = "\n".join(message)
+        updated = self._incidents.update(iid, **params)
+        self.invalidate_components()
+        self.invalidate_incidents(updated)
+
+    def _incident_updates_failed(self, iid, updates, exc):
+        """Drop optimistic changes of failed updates and notify authors
+
+        :param int iid: Incident ID
+        :param list updates: Updates queued by :meth:`cachet_inci_update`
+        :param exc: Raised exception
+        """
+        self.log.warning("Incident %s update failed: %s" % (iid, exc))
+        if self._incident_index is not None:
+            self._incident_index.upsert(updates[0]['incident'])
+        self.invalidate_components()
+        for update in updates:
+            msg = update['msg']
+            self.send(msg.to if msg.is_group else msg.frm,
+                      views.update_failed(iid, exc), in_reply_to=msg)
+
+    def stream_incidents(self, num, keep=None, stop=None, **params):
+        """Get first incidents of a sorted API listing
+
+        Used while the incident index is not built. Pages are requested
+        lazily, only until enough incidents are found. Pages hold ``num``
+        incidents unless ``per_page`` is given. The incident index is
+        built in background for next calls.
+
+        :param int num: Number of incidents, :obj:`None` for no limit
+        :param keep: Incidents filter callable (optional)
+        :param stop: Callable telling if the listing ends at an incident
+                     (optional)
+        :return: :class:`~cachet.models.Incident` records (:func:`list`)
+
+        Additional named arguments are transmitted to API.
+        """
+        self.start_incident_index()
+        if num is not None:
+            params.setdefault('per_page', max(num, 1))
+        incidents = self.fetch_incidents(**params)
+        if stop is not None:
+            incidents = takewhile(lambda incident: not stop(incident),
+                                  incidents)
+        if keep is not None:
+            incidents = (incident for incident in incidents if keep(incident))
+        if num is None:
+            return list(incidents)
+        return list(islice(incidents, max(num, 0)))
+
+    def incident_index_ready(self):
+        """Tell if incident index was built at least once
+
+        :return: :obj:`True` if index can be refreshed incrementally
+        """
+        if self._incident_index is not None:
+            return True
+        return self._cache.fallback.stamp('incident_index') is not None
 
-        self._components = cachet.Components(self._cachet_client)
-        self._incidents = cachet.Incidents(self._cachet_client)
+    def invalidate_incidents(self, *incidents):
+        """Force incident index refresh after an incident change
 
-        super().activate()
+        :param dict incidents: Changed incidents data as returned by the
+                               API, recorded in the index at once
+        """
+        index = self._incident_index
+        for incident in incidents:
+            self._update_logs.invalidate(int(incident['id']))
+            if index is not None:
+                index.upsert(Incident.from_api(incident))
+        self._cache.invalidate('incidents', 'incident_watermark')
+
+    def poll_components(self):
+        """Notify configured rooms of components status changes
+
+        The components snapshot is refreshed on each call and compared to
+        the previous one. A single card listing all changes is sent to each
+        room, nothing is sent when no status changed. With a shared cache
+        backend, the shared snapshot is read again but never dropped.
+        """
+        self._cache.invalidate('components', shared=False)
+        components = {component.id: component
+                      for component in self.get_components()}
+        statuses = {cid: (component.status, component.status_name)
+                    for cid, component in components.items()}
+        previous, self._statuses = self._statuses, statuses
+        if previous is None:
+            return
+
+        worst_status = 1
+        reply = ["Components status changes:"]
+        for cid, old, new in utils.diff_statuses(previous, statuses):
+            if new is None:
+                reply.append("-  `%d`  removed" % cid)
+                continue
+            if new[0] > worst_status:
+                worst_status = new[0]
+            line = "-  `%d`  **%s**: %s %s" % (
+                cid, components[cid].name, utils.ICONS[new[0]], new[1])
+            if old is not None:
+                line += " (was %s %s)" % (utils.ICONS[old[0]], old[1])
+            reply.append(line)
+        if len(reply) == 1:
+            return
+
+        for room in self.config['poll_rooms']:
+            self.send_card(to=self.build_identifier(room),
+                           title=CACHET_TITLE, link=CACHET_LINK,
+                           body="\n".join(reply),
+                           color=utils.COLORS[worst_status])
+
+    def card_max_size(self):
+        """Get card body size limit of the current backend
 
-    def reply_card(self, msg, body, opt_params=None):
+        :return: Maximum card body size in characters (:func:`int`)
+        """
+        sizes = self.config['card_max_sizes'] or {}
+        return sizes.get(self._bot.mode, sizes.get('default', CARD_MAX_SIZE))
+
+    def reply_card(self, msg, body, opt_params=None, sources=()):
         """Reply using send_card method
 
+        Bodies too long for the backend are split at line boundaries in
+        several cards. Each card is sent as soon as its body is complete,
+        lines iterables are consumed lazily. A data date warning is added
+        when the reply is built from stale snapshots.
+
         :arg Object msg: Message object to reply to
-        :arg str body: Card body text
+        :arg body: Card body text or iterable of lines
         :arg dict opt_params: Optionnal parameters to pass to send_card method
+        :arg tuple sources: Snapshot keys the reply is built from
         """
         if opt_params is None:
             opt_params = {}
         options = {
             "title": CACHET_TITLE,
             "link": CACHET_LINK,
-            "body": body,
+            "body": "",
             "color": utils.COLORS[1],
             "in_reply_to": msg
         }
         if len(opt_params):
             options.update(opt_params)
 
-        self.send_card(**options)
+        if isinstance(body, str):
+            body = body.split("\n")
+        stale_since = None
+        if sources and self._cache is not None:
+            stale_since = self._cache.stale_since(*sources)
+        if stale_since is not None:
+            body = chain(body, ["", views.stale_data(stale_since)])
+        title = options['title']
+        sent = False
+        for chunk in utils.chunk_lines(body, self.card_max_size()):
+            if sent:
+                options['title'] = "%s (continued)" % title
+            options['body'] = chunk
+            self.send_card(**options)
+            sent = True
+        if not sent:
+            self.send_card(**options)
 
     @botcmd(split_args_with=None)
+    @timed
     def cachet_plugin_version(self, msg, args):
         """Show cachet plugin version"""
         self.log.debug('Call cachet_plugin_version')
         return "Cachet plugin version: %s" % VERSION
 
+    @arg_botcmd('--prometheus', action='store_true',
+                help="Prometheus text format")
+    @timed
+    def cachet_plugin_stats(self, msg, prometheus):
+        """Show commands and Cachet API calls statistics"""
+        self.log.debug('Call cachet_plugin_stats')
+        if prometheus:
+            return "```\n%s\n```" % self.stats.prometheus()
+        self.reply_card(msg, self.stats.report())
+
     #
     # Components actions
     ##########################################################################
 
     @botcmd(split_args_with=None)
+    @timed
     def cachet_comp_status(self, msg, args):
         """Show components problems"""
         self.log.debug('Call cachet_comp_status')
-        worst_status = 1
-        reply = ["Components problems:"]
-        for component in self._components.get():
-            c_status = int(component['status'])
-            if c_status > 1:
-                if c_status > worst_status:
-                    worst_status = c_status
-                reply.append("-  `%d`  %s: %s %s" % (
-                    component['id'], component['name'],
-                    utils.ICONS[c_status], component['status_name']))
-        if len(reply) == 1:
-            reply.append(":ok: Everything is fine")
-        self.reply_card(msg, "\n".join(reply),
-                        {'color': utils.COLORS[worst_status]})
+        components = self.get_components()
+        sources = {'components': components}
+        counts = None
+        if self.incident_index_ready():
+            index = self.get_incident_index()
+            counts = index.active_counts()
+            sources['incidents'] = index.version
+        # Replies rendered before incident index is ready are kept apart
+        body, worst_status = self._renders.get(
+            ('comp_status', counts is not None), sources,
+            lambda: views.components_problems(components, counts))
+        self.reply_card(msg, body, {'color': utils.COLORS[worst_status]},
+                        sources=tuple(sources))
 
     @botcmd(split_args_with=None)
+    @timed
     def cachet_comp_list_all(self, msg, args):
         """List available components"""
         self.log.debug('Call cachet_comp_list_all')
-        reply = ["Available components:"]
-        for component in self._components.get():
-            c_status = int(component['status'])
-            reply.append("-  `%d`  **%s**: %s %s" % (
-                component['id'], component['name'],
-                utils.ICONS[c_status], component['status_name']))
-        self.reply_card(msg, "\n".join(reply))
+        components = self.get_components()
+        self.reply_card(msg, self._renders.get(
+            ('comp_list_all',), {'components': components},
+            lambda: views.components_list(components)),
+            sources=('components',))
 
     @botcmd(split_args_with=None)
+    @timed
     def cachet_comp_list_groups(self, msg, args):
         """List available component groups"""
         self.log.debug('Call cachet_comp_list_groups')
-        groups = self._components.groups.get()
-        reply = ["Available groups:"]
-        for group in groups:
-            reply.append("-  `%d`  **%s**" % (group['id'], group['name']))
-        self.reply_card(msg, "\n".join(reply))
+        groups = self.get_groups()
+        self.reply_card(msg, self._renders.get(
+            ('comp_list_groups',), {'groups': groups},
+            lambda: views.groups_list(groups)), sources=('groups',))
 
     @arg_botcmd('gid', type=int, help="ID of the group")
+    @timed
     def cachet_comp_list_group(self, msg, gid):
         """List group's components"""
         self.log.debug('Call cachet_comp_list_group')
-        worst_status = 1
-        group = list(self._components.groups.get(gid))[0]
-        reply = [
-            "**Group**: `%s` %s" % (group['id'], group['name']),
+        group = None
+        for entry in self.get_groups():
+            if entry.id == gid:
+                group = entry
+                break
+        if group is None:
+            return views.unknown_group(gid)
+
+        status = self.get_rollup().get(gid) or GroupStatus(gid)
+        header = [
+            "**Group**: `%s` %s" % (group.id, group.name),
+            "**Status:** %s %s, %d/%d components affected" % (
+                utils.ICONS[status.worst_status], status.worst_name,
+                status.degraded, len(status.components)),
             "**Components:**"
         ]
-        for component in self._components.get(group_id=gid):
-            c_status = int(component['status'])
-            reply.append("-  `%d`  **%s**:  %s %s" % (
-                component['id'], component['name'],
-                utils.ICONS[c_status], component['status_name']))
-            if c_status > worst_status:
-                worst_status = c_status
-        self.reply_card(msg, "\n".join(reply),
-                        {'color': utils.COLORS[worst_status]})
+        lines = ("-  `%d`  **%s**:  %s %s" % (
+            component.id, component.name,
+            utils.ICONS[component.status], component.status_name)
+                 for component in status.components)
+        self.reply_card(msg, chain(header, lines),
+                        {'color': utils.COLORS[status.worst_status]},
+                        sources=('groups', 'components'))
+
+    @botcmd(split_args_with=None)
+    @timed
+    def cachet_group_status(self, msg, args):
+        """Show component groups health"""
+        self.log.debug('Call cachet_group_status')
+        groups = self.get_groups()
+        components = self.get_components()
+        body, worst_status = self._renders.get(
+            ('group_status',), {'components': components, 'groups': groups},
+            lambda: views.groups_status(groups, self.get_rollup()))
+        self.reply_card(msg, body, {'color': utils.COLORS[worst_status]},
+                        sources=('groups', 'components'))
 
     @arg_botcmd('cid', type=int, help="ID of the component")
+    @timed
     def cachet_comp_show(self, msg, cid):
         """Show component details"""
         self.log.debug('Call cachet_comp_show')
+        batch = RequestBatch(self._executor)
+        component_request = batch.submit(self.get_component, cid)
+        if self.incident_index_ready():
+            incidents_request = batch.submit(self.get_active_incidents, cid)
+        else:
+            incidents_request = batch.submit(self.fetch_incidents,
+                                             component_id=cid)
         try:
-            component = list(self._components.get(cid))[0]
+            component = component_request.result()
         except requests.exceptions.HTTPError:
             return views.unknown_component(cid)
 
-        c_status = int(component['status'])
-        incidents = list(self._incidents.get(component_id=cid))
+        c_status = component.status
+        incidents = incidents_request.result()
         incidents_lines = []
         for incident in incidents:
-            if int(incident['status']) in (0, 4,):
+            if not is_active(incident):
                 continue
             line = "`%s` **%s**: %s" % (
-                incident['id'], incident['human_status'],
-                incident['name'])
+                incident.id, incident.human_status, incident.name)
             incidents_lines.append(line)
         if not len(incidents_lines):
             incidents_lines = ["No active incident"]
         reply = views.COMPONENT_VIEW % (
-            component['id'], component['name'],
-            utils.ICONS[c_status], component['status_name'],
-            component['link'],
-            component['description'],
-            component['updated_at'],
+            component.id, component.name,
+            utils.ICONS[c_status], component.status_name,
+            component.link,
+            component.description,
+            component.updated_at,
             "\n".join(incidents_lines)
         )
-        self.reply_card(msg, reply, {'color': utils.COLORS[c_status]})
+        self.reply_card(msg, reply, {'color': utils.COLORS[c_status]},
+                        sources=('components', 'incidents'))
 
-    # TODO: implement components search function
+    @arg_botcmd('--num', type=int, help="Number of entries", default=10)
     @arg_botcmd('text', type=str, help="Search text")
-    def cachet_comp_search(self, msg, text):
+    @timed
+    def cachet_comp_search(self, msg, text, num):
         """Search component by name"""
         self.log.debug('Call cachet_comp_search')
-        return "Strong the unimplementation is with this one"
+        reply = ["Matching components:"]
+        for component in self.get_search_index().search(text, num):
+            reply.append("-  `%d`  **%s**: %s %s" % (
+                component.id, component.name,
+                utils.ICONS[component.status], component.status_name))
+        if len(reply) == 1:
+            reply.append("No component found")
+        self.reply_card(msg, "\n".join(reply), sources=('components',))
 
     @arg_botcmd('cstatus', type=str, help="Status of the component")
     @arg_botcmd('cid', type=int, help="ID of the component")
+    @timed
     def cachet_comp_set_status(self, msg, cid, cstatus):
         """Set component status"""
         self.log.debug('Call cachet_comp_set_status')
-        status_info = utils.get_cstatus(cstatus)
+        status_info = self._cstatus.resolve(cstatus)
         if not status_info:
             return "Unknown component status: %s" % (cstatus,)
         self._components.update(cid, status=status_info[0])
+        self.invalidate_components()
         return "Component `%s` status has been set to `%s`" % (
             cid, status_info[1])
 
+    @arg_botcmd('cstatus', type=str, help="Status of the components")
+    @arg_botcmd('targets', type=str,
+                help="Comma separated IDs, ID ranges (3-7), "
+                     "groups (g:4) or name regexes")
+    @timed
+    def cachet_comp_bulk_set_status(self, msg, targets, cstatus):
+        """Set status of several components"""
+        self.log.debug('Call cachet_comp_bulk_set_status')
+        status_info = self._cstatus.resolve(cstatus)
+        if not status_info:
+            return "Unknown component status: %s" % (cstatus,)
+        components = {comp.id: comp for comp in self.get_components()}
+        try:
+            ids, ranges, groups, patterns = utils.parse_targets(
+                targets, RANGE_SPAN_FACTOR * max(len(components), 10))
+        except ValueError as exc:
+            return "Invalid components range, %s" % exc
+        except re.error as exc:
+            return "Invalid components pattern: %s" % exc
+
+        # Only explicitly listed IDs are reported as unknown
+        selected = set(ids)
+        for cid, component in components.items():
+            if any(start <= cid <= end for start, end in ranges):
+                selected.add(cid)
+            elif component.group_id and component.group_id in groups:
+                selected.add(cid)
+            elif any(regex.search(component.name) for regex in patterns):
+                selected.add(cid)
+        if not selected:
+            return "No component matching: %s" % targets
+
+        requests_by_id = {}
+        for cid in sorted(selected):
+            if cid in components:
+                requests_by_id[cid] = self._executor.submit(
+                    self._components.update, cid, status=status_info[0])
+
+        reply = ["Components status set to `%s`:" % status_info[1]]
+        for cid in sorted(selected):
+            if cid not in components:
+                reply.append("-  `%d`  :x: unknown component" % cid)
+                continue
+            try:
+                requests_by_id[cid].result()
+                result = ":white_check_mark: done"
+            except requests.exceptions.RequestException as exc:
+                result = ":x: %s" % exc
+            reply.append("-  `%d`  **%s**: %s" % (
+                cid, components[cid].name, result))
+        self.invalidate_components()
+        self.reply_card(msg, "\n".join(reply),
+                        {'color': utils.COLORS[status_info[0]]})
+
     #
     # Maintenances actions
     ##########################################################################
 
     @arg_botcmd('--num', type=int, help="Number of entries", default=5)
+    @timed
     def cachet_maint_forecast(self, msg, num):
         """List upcoming maintenances"""
         self.log.debug('Call cachet_maint_forecast')
-        # Selecting scheduled operation from "incidents" and sorting
-        incidents = self._incidents.get()
-        scheduled = [ent for ent in incidents if ent['status'] == '0']
-        scheduled.sort(key=lambda entry: entry['scheduled_at'])
-
-        now = datetime.now()
+        now = int(time.time())
+        if self.incident_index_ready():
+            scheduled = self.get_incident_index().upcoming(now, num)
+        else:
+            # Listed from the furthest one, until past maintenances
+            scheduled = self.stream_incidents(
+                None, stop=lambda ent: ent.scheduled_ts <= now,
+                status=0, sort='scheduled_at', order='desc')
+            scheduled = scheduled[::-1][0:max(num, 0)]
 
         reply = ["Upcoming operations:"]
-        for maintenance in scheduled[0:num]:
-            if datetime.strptime(maintenance['scheduled_at'],
-                                 DATE_FORMAT) > now:
-                reply.append("-  `%s` Scheduled on **%s**: %s" % (
-                    maintenance['id'],
-                    maintenance['scheduled_at'], maintenance['name']))
+        for maintenance in scheduled:
+            reply.append("-  `%s` Scheduled on **%s**: %s" % (
+                maintenance.id, maintenance.scheduled_at, maintenance.name))
 
         if len(reply) == 1:
             reply.append("No operation found")
-        self.reply_card(msg, "\n".join(reply))
+        self.reply_card(msg, "\n".join(reply), sources=('incidents',))
 
     @arg_botcmd('--num', type=int, help="Number of entries", default=5)
+    @timed
     def cachet_maint_last(self, msg, num):
         """List past maintenances"""
         self.log.debug('Call cachet_maint_last')
-        # Selecting scheduled operation from "incidents" and sorting
-        incidents = self._incidents.get()
-        scheduled = [ent for ent in incidents if ent['status'] == '0']
-        scheduled.sort(key=lambda entry: entry['scheduled_at'])
-
-        now = datetime.now()
+        now = int(time.time())
+        if self.incident_index_ready():
+            scheduled = self.get_incident_index().past(now, num)
+        else:
+            scheduled = self.stream_incidents(
+                num, keep=lambda ent: ent.scheduled_ts <= now,
+                status=0, sort='scheduled_at', order='desc')
 
         reply = ["Past maintenances:"]
-        for maint in scheduled[0:int(num)]:
-            if datetime.strptime(maint['scheduled_at'],
-                                 DATE_FORMAT) < now:
-                reply.append("-  `%s` **%s**: %s" % (maint['id'],
-                                                     maint['scheduled_at'],
-                                                     maint['name']))
+        for maint in scheduled:
+            reply.append("-  `%s` **%s**: %s" % (maint.id, maint.scheduled_at,
+                                                 maint.name))
 
         if len(reply) == 1:
             reply.append("No maintenance found")
-        self.reply_card(msg, "\n".join(reply))
+        self.reply_card(msg, "\n".join(reply), sources=('incidents',))
 
     # TODO: implement maintenance creation function
     @arg_botcmd('desc', type=str, help="Maintenance description")
     @arg_botcmd('name', type=str, help="Maintenance name")
     @arg_botcmd('cid', type=int, help="Component ID")
     @arg_botcmd('schedule', type=str, help="Maintenance schedule date")
+    @timed
     def cachet_maint_new(self, msg, schedule, cid, name, desc):
         """Creation new maintenance"""
         self.log.debug('Call cachet_maint_new')
@@ -302,69 +1057,110 @@ class Cachet(BotPlugin):
     # Incidents actions
     ##########################################################################
 
+    @arg_botcmd('--period', type=str,
+                help="Creation period: [date]>[date]", default=None)
     @arg_botcmd('--num', type=int, help="Number of entries", default=5)
-    def cachet_inci_last(self, msg, num):
+    @timed
+    def cachet_inci_last(self, msg, num, period):
         """List last incidents"""
         self.log.debug('Call cachet_inci_last')
-        # It is actually not possible to sort incident by date via Cachet
-        # We get long list of incident and sort it by ourselves
-        incidents = self._incidents.get()
-        # Cleaning scheduled operation from "incidents"
-        incidents = [ent for ent in incidents if ent['status'] != '0']
-        incidents.sort(key=lambda entry: entry['created_at'], reverse=True)
-        reply = ["Last incidents:"]
-        for incident in incidents[0:int(num)]:
-            reply.append("-  `%s`  [%s] `%s` %s" % (incident['id'],
-                                                    incident['created_at'],
-                                                    incident['human_status'],
-                                                    incident['name']))
-        self.reply_card(msg, "\n".join(reply))
+        start = end = None
+        if period:
+            try:
+                start, end = utils.parse_period(period)
+            except ValueError as exc:
+                return "Invalid period: %s" % exc
 
+        # Scheduled operations are kept apart in the incident index
+        if self.incident_index_ready():
+            incidents = self.get_incident_index().last(num, start, end)
+        else:
+            def keep(incident):
+                return not is_scheduled(incident) and (
+                    end is None or incident.created_ts <= end)
+
+            def stop(incident):
+                return start is not None and incident.created_ts < start
+
+            # Periods may be far in the past, they are scanned in large
+            # pages until their start
+            params = {'per_page': REBUILD_PAGE_SIZE} if period else {}
+            incidents = self.stream_incidents(num, keep=keep, stop=stop,
+                                              sort='created_at',
+                                              order='desc', **params)
+        reply = ["Last incidents:"]
+        for incident in incidents:
+            reply.append("-  `%s`  [%s] `%s` %s" % (incident.id,
+                                                    incident.created_at,
+                                                    incident.human_status,
+                                                    incident.name))
+        self.reply_card(msg, "\n".join(reply), sources=('incidents',))
+
+    @arg_botcmd('--page', type=int, help="Updates page, 1 for latest",
+                default=1)
+    @arg_botcmd('--num', type=int, help="Updates per page", default=3)
     @arg_botcmd('i_id', type=int, help="ID of the Incident")
-    def cachet_inci_show(self, msg, i_id):
-        """Show incident details"""
+    @timed
+    def cachet_inci_show(self, msg, i_id, num, page):
+        """Show incident details and updates"""
         self.log.debug('Call cachet_inci_show')
+        batch = RequestBatch(self._executor)
+        incident_request = batch.submit(self.get_incident, i_id)
+        # Components snapshot and Cachet version are requested while
+        # incident is requested
+        batch.submit(self.get_components)
+        batch.submit(self.cachet_version)
+        stale_since = None
         try:
-            incident = list(self._incidents.get(i_id))[0]
+            incident = incident_request.result()
         except requests.exceptions.HTTPError:
             return views.unknown_incident(i_id)
-
-        if incident['component_id'] != "0":
-            component = list(self._components.get(incident['component_id']))[0]
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
+            known = self.get_indexed_incident(i_id)
+            if known is None:
+                raise
+            incident, stale_since = known
+
+        if incident.component_id:
+            component = self.get_component(incident.component_id)
         else:
             # TODO: clean this
-            component = {
+            component = Component.from_api({
                 'id': 0,
                 'name': "No component specified",
                 'status_name': "Unavailable",
                 'status': 0
-            }
-        c_status = int(component['status'])
+            })
+        c_status = component.status
         reply = [
-            '**Incident status:** `%s`' % (incident['human_status']),
-            '**Component:** `%d` %s' % (component['id'], component['name']),
+            '**Incident status:** `%s`' % (incident.human_status),
+            '**Component:** `%d` %s' % (component.id, component.name),
             '**Component status:** %s %s' % (utils.ICONS[c_status],
-                                             component['status_name']),
-            '_Created at_ `%s`' % (incident['created_at']),
-            '_Last updated_ `%s`' % (incident['updated_at']),
-            '**Description:**',
-            incident['message']
+                                             component.status_name),
+            '_Created at_ `%s`' % (incident.created_at),
+            '_Last updated_ `%s`' % (incident.updated_at),
         ]
-        title = '%s: [%d] %s' % (CACHET_TITLE,
-                                 incident['id'], incident['name'])
-        link = '%s/incident/%d' % (CACHET_LINK, incident['id'])
+        reply.extend(views.incident_updates(self.get_update_log(incident),
+                                            incident.id, num, page))
+        if stale_since is not None:
+            reply.extend(["", views.stale_data(stale_since)])
+        title = '%s: [%d] %s' % (CACHET_TITLE, incident.id, incident.name)
+        link = '%s/incident/%d' % (CACHET_LINK, incident.id)
         self.reply_card(msg, "\n".join(reply), {
-            'title': title, 'link': link, 'color': utils.COLORS[c_status]})
+            'title': title, 'link': link, 'color': utils.COLORS[c_status]},
+            sources=('components',))
 
     @arg_botcmd('desc', type=str, help="Incident description message")
     @arg_botcmd('name', type=str, help="Name of the incident")
     @arg_botcmd('cstatus', type=str, help="Status of the impacted component")
     @arg_botcmd('cid', type=str, help="ID the impacted component")
     @arg_botcmd('istatus', type=str, help="Status of the incident")
+    @timed
     def cachet_inci_new(self, msg, istatus, cstatus, cid, name, desc):
         """Declare new incident"""
         self.log.debug('Call cachet_inci_new')
-        istatus_info = utils.get_istatus(istatus)
+        istatus_info = self._istatus.resolve(istatus)
         if not istatus_info:
             return "Unknown incident status: %s" % istatus
 
@@ -374,19 +1170,20 @@ class Cachet(BotPlugin):
             cid = None
 
         if cid:
-            if not cstatus:
-                comp = list(self._components.get(cid))[0]
-                cstatus_info = (int(comp['status']), comp['status_name'])
-            else:
-                cstatus_info = utils.get_cstatus(cstatus)
-
-            if not cstatus_info:
-                return "Unknown component status: %s" % cstatus
-
             try:
-                list(self._components.get(cid))
+                comp = self.get_component(cid)
             except requests.exceptions.HTTPError:
+                comp = None
+
+            if cstatus:
+                cstatus_info = self._cstatus.resolve(cstatus)
+                if not cstatus_info:
+                    return "Unknown component status: %s" % cstatus
+
+            if comp is None:
                 return views.unknown_component(cid)
+            if not cstatus:
+                cstatus_info = (comp.status, comp.status_name)
 
             msg_header = views.message_header(istatus_info[1], cstatus_info[1])
             updated_msg = msg_header + '\n' + desc
@@ -394,10 +1191,12 @@ class Cachet(BotPlugin):
                 name, updated_msg, istatus_info[0], 0,
                 component_id=cid,
                 component_status=cstatus_info[0])
+            self.invalidate_components()
         else:
             msg_header = "##### [%s] %s\n" % (datetime.now(), istatus_info[1])
             created = self._incidents.create(name, msg_header + desc,
                                              istatus_info[0], 0)
+        self.invalidate_incidents(created)
 
         return (
             "New incident declared.\n"
@@ -409,11 +1208,12 @@ class Cachet(BotPlugin):
     @arg_botcmd('cstatus', type=str, help="Status of the component")
     @arg_botcmd('istatus', type=str, help="Status of the Incident")
     @arg_botcmd('iid', type=int, help="ID of the Incident")
+    @timed
     def cachet_inci_update(self, msg, iid, istatus, cstatus, imsg):
         """Update incident"""
         self.log.debug('Call cachet_inci_update')
         try:
-            incident = list(self._incidents.get(iid))[0]
+            incident = self.get_known_incident(iid)
         except requests.exceptions.HTTPError:
             return views.unknown_incident(iid)
 
@@ -423,65 +1223,118 @@ class Cachet(BotPlugin):
             cstatus = None
 
         if istatus:
-            istatus_info = utils.get_istatus(istatus)
+            istatus_info = self._istatus.resolve(istatus)
             if not istatus_info:
                 return "Unknown incident status: %s" % istatus
         else:
-            istatus_info = utils.get_istatus(incident['human_status'])
+            istatus_info = (incident.status, incident.human_status)
 
-        if cstatus and incident['component_id'] == "0":
+        if cstatus and not incident.component_id:
             return ("No component impacted by incident, "
                     "please set one before updating component status.")
 
         if cstatus:
-            cstatus_info = utils.get_cstatus(cstatus)
+            cstatus_info = self._cstatus.resolve(cstatus)
             if not cstatus_info:
                 return "Unknown component status: %s" % cstatus
         else:
-            component = list(self._components.get(incident['component_id']))[0]
-            cstatus_info = utils.get_cstatus(component['status_name'])
-
-        updated_msg = [views.message_header(istatus_info[1], cstatus_info[1]),
-                       imsg,
-                       views.updates_separator(),
-                       incident["message"]]
-
-        self._incidents.update(iid, status=istatus_info[0],
-                               component_id=incident['component_id'],
-                               component_status=cstatus_info[0],
-                               message="\n".join(updated_msg))
+            component = self.get_component(incident.component_id)
+            cstatus_info = (component.status, component.status_name)
+
+        header = views.message_header(istatus_info[1], cstatus_info[1])
+
+        # Written in background, next reads see the incident as updated
+        optimistic = incident.replace(
+            status=istatus_info[0], human_status=istatus_info[1],
+            message="\n".join([header, imsg, views.updates_separator(),
+                               incident.message]))
+        self._updates.submit(iid, {'status': istatus_info[0],
+                                   'component_status': cstatus_info[0],
+                                   'header': header,
+                                   'message': imsg,
+                                   'incident': incident,
+                                   'msg': msg}, optimistic)
+        if self._incident_index is not None:
+            self._incident_index.upsert(optimistic)
+        if incident.component_id:
+            self._cache.patch('components', lambda components: [
+                component.replace(status=cstatus_info[0],
+                                  status_name=cstatus_info[1])
+                if component.id == incident.component_id else component
+                for component in components])
         return "Incident has been updated."
 
-    # TODO: implement incidents search function
-    @arg_botcmd('text', type=str, help="Search text")
-    def cachet_inci_search(self, msg, text):
+    @arg_botcmd('--num', type=int, help="Number of entries", default=5)
+    @arg_botcmd('text', type=str, help="Search text or regex")
+    @timed
+    def cachet_inci_search(self, msg, text, num):
         """Search incident by name"""
         self.log.debug('Call cachet_inci_search')
-        return "This command is still not implemented."
+        plain_text = re.match(r'^[\w\s]+$', text)
+        try:
+            regex = re.compile(text, re.IGNORECASE)
+        except re.error:
+            regex = re.compile(re.escape(text), re.IGNORECASE)
+
+        if not self.incident_index_ready():
+            # Do not wait for the whole history to be indexed, plain text
+            # is matched as the index would
+            self.start_incident_index()
+            found = []
+            for incident in self.fetch_incidents(sort='id', order='desc'):
+                if len(found) >= num:
+                    break
+                if plain_text:
+                    matched = match_text(text, incident)
+                else:
+                    matched = match_incident(regex, incident)
+                if matched:
+                    found.append(incident)
+        elif plain_text:
+            found = self.get_incident_index().search(text, num)
+        else:
+            found = self.get_incident_index().search_regex(regex, num)
+
+        reply = ["Matching incidents:"]
+        for incident in found:
+            reply.append("-  `%s`  [%s] `%s` %s" % (incident.id,
+                                                    incident.created_at,
+                                                    incident.human_status,
+                                                    incident.name))
+        if len(reply) == 1:
+            reply.append("No incident found")
+        self.reply_card(msg, "\n".join(reply), sources=('incidents',))
 
     @arg_botcmd('cid', type=int, help="ID of the component")
     @arg_botcmd('iid', type=int, help="ID of the incident")
+    @timed
     def cachet_inci_set_component(self, msg, iid, cid):
         """Set impacted component"""
         self.log.debug('Call cachet_inci_set_component')
+        batch = RequestBatch(self._executor)
+        incident_request = batch.submit(self.get_incident, iid)
+        component_request = batch.submit(self.get_component, cid)
         try:
-            list(self._incidents.get(iid))
+            incident_request.result()
         except requests.exceptions.HTTPError:
             return views.unknown_incident(iid)
 
         try:
-            component_info = list(self._components.get(cid))[0]
+            component_info = component_request.result()
         except requests.exceptions.HTTPError:
             return views.unknown_component(cid)
 
-        self._incidents.update(iid,
-                               component_status=component_info['status'],
-                               component_id=cid)
+        updated = self._incidents.update(
+            iid, component_status=component_info.status,
+            component_id=cid)
+        self.invalidate_components()
+        self.invalidate_incidents(updated)
         return "Impacted component has been updated."
 
     # Todo: implement this function when Cachet 2.4 is released
     @arg_botcmd('date', type=str, help="Incident new date")
     @arg_botcmd('iid', type=int, help="ID of the incident")
+    @timed
     def cachet_inci_set_date(self, msg, iid, date):
         """Set incident's date"""
         self.log.debug('Call cachet_inci_set_date')
@@ -489,34 +1342,40 @@ class Cachet(BotPlugin):
 
     @arg_botcmd('name', type=str, help="Incident new name")
     @arg_botcmd('iid', type=int, help="ID of the incident")
+    @timed
     def cachet_inci_rename(self, msg, iid, name):
         """Rename incident"""
         self.log.debug('Call cachet_inci_rename')
         try:
-            list(self._incidents.get(iid))
+            self.get_incident(iid)
         except requests.exceptions.HTTPError:
             return views.unknown_incident(iid)
-        self._incidents.update(iid, name=name)
+        updated = self._incidents.update(iid, name=name)
+        self.invalidate_incidents(updated)
         return "Incident name has been updated."
 
     @arg_botcmd('iid', type=int, help="ID of the incident")
+    @timed
     def cachet_inci_set_hidden(self, msg, iid):
         """Hide incident from status page"""
         self.log.debug('Call cachet_inci_set_hidden')
         try:
-            list(self._incidents.get(iid))
+            self.get_incident(iid)
         except requests.exceptions.HTTPError:
             return views.unknown_incident(iid)
-        self._incidents.update(iid, visible=0)
+        updated = self._incidents.update(iid, visible=0)
+        self.invalidate_incidents(updated)
         return "Incident is hidden from status page."
 
     @arg_botcmd('iid', type=int, help="ID of the incident")
+    @timed
     def cachet_inci_set_visible(self, msg, iid):
         """Set incident visible on status page"""
         self.log.debug('Call cachet_inci_set_visible')
         try:
-            list(self._incidents.get(iid))
+            self.get_incident(iid)
         except requests.exceptions.HTTPError:
             return views.unknown_incident(iid)
-        self._incidents.update(iid, visible=1)
+        updated = self._incidents.update(iid, visible=1)
+        self.invalidate_incidents(updated)
         return "Incident has been set to visible on status page."
@@ -0,0 +1,184 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""Snapshots backends shared by bot instances
+
+Backends store (storage time, value) records by key, storage time is a
+UNIX timestamp. They implement ``stamp``, ``load``, ``store`` and
+``delete`` methods and are used by :class:`~cachet.cache.SnapshotCache`.
+Process memory is the default, no backend is needed for it.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+# Available backends, as set by cache_backend setting
+CACHE_BACKENDS = ('memory', 'sqlite', 'storage')
+
+
+class SQLiteBackend(object):
+    """Snapshots shared through a local SQLite database file
+
+    Bot instances running on the same host share their snapshots through
+    the database file. Values are stored as JSON. Database errors are
+    logged and handled as cache misses.
+
+    :param str path: Database file path
+    """
+
+    def __init__(self, path):
+        """Init method"""
+        self.path = path
+        self._local = threading.local()
+        self._execute("CREATE TABLE IF NOT EXISTS snapshots ("
+                      "key TEXT PRIMARY KEY, stored_at REAL, value TEXT)")
+
+    def _connection(self):
+        """Get connection of the current thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _execute(self, query, *params):
+        """Run a query in its own transaction
+
+        :return: First result row or :obj:`None`
+        """
+        try:
+            with self._connection() as connection:
+                return connection.execute(query, params).fetchone()
+        except sqlite3.Error as exc:
+            log.warning("Cachet snapshots database error: %s", exc)
+            return None
+
+    def stamp(self, key):
+        """Get snapshot storage time
+
+        :param str key: Snapshot key
+        :return: UNIX timestamp or :obj:`None` if snapshot is unknown
+        """
+        row = self._execute("SELECT stored_at FROM snapshots WHERE key = ?",
+                            key)
+        return row[0] if row else None
+
+    def load(self, key):
+        """Get snapshot
+
+        :param str key: Snapshot key
+        :return: :func:`tuple` (storage time, value) or :obj:`None`
+        """
+        row = self._execute("SELECT stored_at, value FROM snapshots "
+                            "WHERE key = ?", key)
+        return (row[0], json.loads(row[1])) if row else None
+
+    def store(self, key, stored_at, value):
+        """Store snapshot
+
+        :param str key: Snapshot key
+        :param float stored_at: Storage UNIX timestamp
+        :param value: JSON serializable snapshot value
+        """
+        self._execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)",
+                      key, stored_at, json.dumps(value))
+
+    def delete(self, *keys):
+        """Drop snapshots
+
+        :param str keys: Snapshot keys
+        """
+        for key in keys:
+            self._execute("DELETE FROM snapshots WHERE key = ?", key)
+
+
+class StorageBackend(object):
+    """Snapshots shared through errbot storage
+
+    Snapshots are shared by bot instances using the same storage plugin,
+    such as a Redis or SQL storage.
+
+    :param storage: Errbot storage mapping, e.g. the plugin itself
+    """
+
+    # Storage keys prefix
+    PREFIX = 'cache_'
+
+    # Storage keys suffix of snapshots storage time, read without loading
+    # snapshots
+    STAMP_SUFFIX = ':stamp'
+
+    def __init__(self, storage):
+        """Init method"""
+        self._storage = storage
+        self._lock = threading.Lock()
+
+    def stamp(self, key):
+        """Get snapshot storage time
+
+        :param str key: Snapshot key
+        :return: UNIX timestamp or :obj:`None` if snapshot is unknown
+        """
+        with self._lock:
+            try:
+                return self._storage[self.PREFIX + key + self.STAMP_SUFFIX]
+            except KeyError:
+                return None
+
+    def load(self, key):
+        """Get snapshot
+
+        :param str key: Snapshot key
+        :return: :func:`tuple` (storage time, value) or :obj:`None`
+        """
+        with self._lock:
+            try:
+                return tuple(self._storage[self.PREFIX + key])
+            except KeyError:
+                return None
+
+    def store(self, key, stored_at, value):
+        """Store snapshot
+
+        :param str key: Snapshot key
+        :param float stored_at: Storage UNIX timestamp
+        :param value: Snapshot value
+        """
+        with self._lock:
+            self._storage[self.PREFIX + key] = (stored_at, value)
+            self._storage[self.PREFIX + key + self.STAMP_SUFFIX] = stored_at
+
+    def delete(self, *keys):
+        """Drop snapshots
+
+        :param str keys: Snapshot keys
+        """
+        with self._lock:
+            for key in keys:
+                for name in (key, key + self.STAMP_SUFFIX):
+                    try:
+                        del self._storage[self.PREFIX + name]
+                    except KeyError:
+                        pass
@@ -0,0 +1,423 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import time
+import threading
+from collections import OrderedDict
+
+# Number of rendered replies kept in memory
+RENDERED_REPLIES = 128
+
+# Number of incident update logs kept in memory
+UPDATE_LOGS = 256
+
+
+class Flight(object):
+    """In-flight fetch shared by concurrent callers"""
+
+    def __init__(self):
+        """Init method"""
+        self._event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def done(self, value=None, error=None):
+        """Publish fetch result to waiting callers"""
+        self.value = value
+        self.error = error
+        self._event.set()
+
+    def wait(self, timeout=None):
+        """Wait for fetch result
+
+        :param float timeout: Maximum waiting time in seconds (optional)
+        :return: Fetched value, fetch exception is raised again if any
+        :raise: :class:`TimeoutError` if fetch is still running on timeout
+        """
+        if not self._event.wait(timeout):
+            raise TimeoutError("Fetch is still running")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SnapshotCache(object):
+    """Snapshot cache with TTL and stampede protection
+
+    Concurrent callers asking for the same expired key share a single
+    in-flight fetch. Keys invalidated while a fetch is running are not
+    stored, so writes are never hidden by a stale read.
+
+    Snapshots are kept in process memory. With a shared ``backend`` (see
+    :mod:`cachet.backends`), expired snapshots are first looked up in the
+    backend, so bot instances sharing it only fetch each snapshot once per
+    TTL. Snapshots read again from the backend without change keep their
+    identity. Snapshots of :mod:`cachet.models` records are dumped to
+    plain values in backends.
+
+    With a latency ``budget``, expired snapshots are refreshed in
+    background. Callers wait for the refresh at most ``budget`` seconds,
+    the previous snapshot is served if it takes longer or fails. Keys
+    served that way are listed in :attr:`stale` until refreshed. Fetched
+    snapshots are persisted in ``fallback`` so a previous snapshot is
+    still available after a restart.
+
+    :param int ttl: Snapshot time to live in seconds
+    :param backend: Shared snapshots backend (optional)
+    :param float budget: Latency budget in seconds (optional)
+    :param fallback: Backend persisting last snapshots (optional)
+    """
+
+    def __init__(self, ttl=30, backend=None, budget=None, fallback=None):
+        """Init method"""
+        self.ttl = ttl
+        self.backend = backend
+        self.budget = budget
+        self.fallback = fallback
+        self.stale = {}
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+        self._generation = 0
+
+    def get(self, key, fetch, shared=True, restore=None, model=None):
+        """Get snapshot from cache or fetch it
+
+        :param str key: Snapshot key
+        :param fetch: Callable returning snapshot value
+        :param bool shared: Look up and store snapshot in shared and
+                            fallback backends, its value must then be
+                            JSON serializable
+        :param restore: Callable returning last persisted snapshot as a
+                        (storage time, value) tuple or :obj:`None`, used
+                        with a latency budget when no snapshot is in
+                        memory (optional, defaults to fallback backend)
+        :param model: :class:`~cachet.models.Model` class of snapshot
+                      entries, for snapshots listing records (optional)
+        :return: Snapshot value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                return entry[2]
+            flight = self._inflight.get(key)
+            refresh = None
+            if flight is None:
+                flight = self._inflight[key] = Flight()
+                refresh = (key, fetch, shared, model, entry,
+                           self._generation, flight)
+
+        if self.budget is None:
+            if refresh is not None:
+                self._refresh(*refresh)
+            return flight.wait()
+        if refresh is not None:
+            threading.Thread(target=self._refresh, args=refresh,
+                             daemon=True).start()
+
+        try:
+            return flight.wait(self.budget)
+        except Exception as exc:
+            previous = entry[1:] if entry else self._restore(
+                key, shared, restore, model)
+            if previous is None:
+                if isinstance(exc, TimeoutError):
+                    return flight.wait()
+                raise
+            with self._lock:
+                self.stale[key] = previous[0]
+            return previous[1]
+
+    def _restore(self, key, shared, restore, model):
+        """Get last persisted snapshot
+
+        Restored snapshot is kept in memory as an expired entry.
+
+        :return: :func:`tuple` (storage time, value) or :obj:`None`
+        """
+        if restore is not None:
+            previous = restore()
+        elif shared and self.fallback is not None:
+            previous = self._decode(model, self.fallback.load(key))
+        else:
+            previous = None
+        if previous is not None:
+            with self._lock:
+                self._entries.setdefault(
+                    key, (time.monotonic() - self.ttl,) + tuple(previous))
+        return previous
+
+    def _refresh(self, key, fetch, shared, model, entry, generation,
+                 flight):
+        """Fetch snapshot and publish it to waiting callers"""
+        backend = self.backend if shared else None
+        fallback = self.fallback if shared else None
+        try:
+            record = self._load(backend, key, entry, model)
+            if record is None:
+                record = (time.time(), fetch())
+                if backend is not None:
+                    backend.store(key, record[0],
+                                  self._encode(model, record[1]))
+            if fallback not in (None, backend) and (
+                    entry is None or entry[2] is not record[1]):
+                fallback.store(key, record[0],
+                               self._encode(model, record[1]))
+        except Exception as exc:
+            with self._lock:
+                del self._inflight[key]
+            flight.done(error=exc)
+            return
+
+        with self._lock:
+            del self._inflight[key]
+            self.stale.pop(key, None)
+            if generation == self._generation:
+                # Snapshots from backend expire with their original copy
+                age = max(0, time.time() - record[0])
+                self._entries[key] = (time.monotonic() - age,) + record
+        flight.done(record[1])
+
+    def stale_since(self, *keys):
+        """Get storage time of the oldest stale snapshot being served
+
+        :param str keys: Snapshot keys, all snapshots if none given
+        :return: UNIX timestamp or :obj:`None` if snapshots are fresh
+        """
+        with self._lock:
+            stamps = [self.stale[key] for key in keys or self.stale
+                      if key in self.stale]
+        return min(stamps) if stamps else None
+
+    @staticmethod
+    def _encode(model, value):
+        """Dump snapshot records to plain values"""
+        if model is None:
+            return value
+        return [entry.dump() for entry in value]
+
+    @staticmethod
+    def _decode(model, record):
+        """Load snapshot records of a backend (storage time, value) record"""
+        if model is None or record is None:
+            return record
+        return record[0], [model.load(values) for values in record[1]]
+
+    def _load(self, backend, key, entry, model):
+        """Get a snapshot stored in backend by another instance
+
+        :return: :func:`tuple` (storage time, value) or :obj:`None` if
+                 backend has no fresh snapshot
+        """
+        if backend is None:
+            return None
+        stored_at = backend.stamp(key)
+        if stored_at is None or time.time() - stored_at >= self.ttl:
+            return None
+        if entry is not None and entry[1] == stored_at:
+            return entry[1:]
+        return self._decode(model, backend.load(key))
+
+    def patch(self, key, update):
+        """Change a snapshot in memory
+
+        Used for optimistic updates: the patched snapshot is not stored in
+        backends and fetches running while patching are dropped. It is
+        replaced by the next fetch once expired or invalidated.
+
+        :param str key: Snapshot key
+        :param update: Callable returning new snapshot from current one
+        :return: :obj:`True` if snapshot was patched
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            self._generation += 1
+            self._entries[key] = entry[:2] + (update(entry[2]),)
+            return True
+
+    def invalidate(self, *keys, shared=True):
+        """Invalidate snapshots
+
+        Invalidated keys are also dropped from shared backend, unless
+        ``shared`` is false: the next get then reads the shared snapshot
+        again, or fetches it once expired.
+
+        :param str keys: Snapshot keys to drop, all snapshots if none given
+        :param bool shared: Drop snapshots from shared backend
+        """
+        with self._lock:
+            self._generation += 1
+            if not keys:
+                self._entries.clear()
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.backend is not None and keys and shared:
+            self.backend.delete(*keys)
+
+
+class VersionedFetch(object):
+    """Fetch reusing previous result while data version is unchanged
+
+    Data version is expected to be much cheaper to get than the data
+    itself, the previously fetched value is returned as is when versions
+    match. Versions are only a hint: :meth:`reset` forces the next fetch
+    after a local write, and results older than ``max_age`` seconds are
+    fetched again whatever their version.
+
+    :param version: Callable returning current data version
+    :param fetch: Callable returning data
+    :param float max_age: Maximum result reuse time in seconds (optional)
+    """
+
+    def __init__(self, version, fetch, max_age=None):
+        """Init method"""
+        self._version = version
+        self._fetch = fetch
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._result = None
+        self._generation = 0
+
+    def __call__(self):
+        """Get data, fetched again only if its version changed"""
+        with self._lock:
+            result, generation = self._result, self._generation
+        version = self._version()
+        if result is not None and result[0] == version and (
+                self.max_age is None or
+                time.monotonic() - result[2] < self.max_age):
+            return result[1]
+        value = self._fetch()
+        with self._lock:
+            # Results fetched while reset may miss the local write
+            if generation == self._generation:
+                self._result = (version, value, time.monotonic())
+        return value
+
+    def reset(self):
+        """Forget previous result, next call fetches data"""
+        with self._lock:
+            self._generation += 1
+            self._result = None
+
+
+class RenderCache(object):
+    """Rendered replies memoized on data version
+
+    Replies are stored with the snapshots they were rendered from. A reply
+    is reused while these snapshots are the current ones, replies rendered
+    from a snapshot are evicted as soon as a new version of it is seen.
+    Snapshots are compared by identity, :class:`SnapshotCache` and
+    :class:`VersionedFetch` return the same object while data is unchanged.
+
+    :param int max_entries: Number of replies kept
+    """
+
+    def __init__(self, max_entries=RENDERED_REPLIES):
+        """Init method"""
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._current = {}
+
+    def _track(self, sources):
+        """Evict replies rendered from outdated snapshots"""
+        for name, snapshot in sources.items():
+            if self._current.get(name) is snapshot:
+                continue
+            self._current[name] = snapshot
+            for key, entry in list(self._entries.items()):
+                if name in entry[0]:
+                    del self._entries[key]
+
+    def get(self, key, sources, render):
+        """Get rendered reply from cache or render it
+
+        :param tuple key: Command name and arguments
+        :param dict sources: Snapshots the reply is rendered from by name
+        :param render: Callable returning the rendered reply
+        :return: Rendered reply
+        """
+        with self._lock:
+            self._track(sources)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = render()
+        with self._lock:
+            self._track(sources)
+            self._entries[key] = (sources, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        """Number of cached replies"""
+        return len(self._entries)
+
+
+class UpdateLogCache(object):
+    """Incident update logs cached per incident version
+
+    Logs are parsed or fetched once per incident version, least recently
+    used logs are evicted first.
+
+    :param int max_entries: Number of logs kept
+    """
+
+    def __init__(self, max_entries=UPDATE_LOGS):
+        """Init method"""
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, iid, version, load):
+        """Get incident update log from cache or load it
+
+        :param int iid: Incident ID
+        :param version: Incident version, e.g. its update date
+        :param load: Callable returning the update log
+        :return: Update log
+        """
+        with self._lock:
+            entry = self._entries.get(iid)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(iid)
+                return entry[1]
+
+        log = load()
+        with self._lock:
+            self._entries[iid] = (version, log)
+            self._entries.move_to_end(iid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return log
+
+    def invalidate(self, iid):
+        """Drop update log of an incident
+
+        :param int iid: Incident ID
+        """
+        with self._lock:
+            self._entries.pop(iid, None)
@@ -0,0 +1,168 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class RequestBatch(object):
+    """Concurrent API requests issued by a single command
+
+    Requests are run on a shared executor as soon as they are submitted.
+    Identical requests submitted twice in the same batch are only issued
+    once and share their result.
+
+    :param executor: :class:`concurrent.futures.Executor` instance
+    """
+
+    def __init__(self, executor):
+        """Init method"""
+        self._executor = executor
+        self._futures = {}
+
+    def submit(self, func, *args, **kwargs):
+        """Submit a request
+
+        Generators returned by pylls are consumed on the executor, so the
+        API requests really run concurrently.
+
+        :param func: Callable issuing the request
+        :return: :class:`concurrent.futures.Future` of the request result
+        """
+        key = (func, args, tuple(sorted(kwargs.items())))
+        if key not in self._futures:
+            self._futures[key] = self._executor.submit(
+                self._call, func, *args, **kwargs)
+        return self._futures[key]
+
+    @staticmethod
+    def _call(func, *args, **kwargs):
+        """Call request function and consume returned generator"""
+        result = func(*args, **kwargs)
+        if hasattr(result, '__next__'):
+            return list(result)
+        return result
+
+
+class MutationQueue(object):
+    """Background writes merging rapid changes of the same entry
+
+    Changes are written by ``write`` on a shared executor, one write at a
+    time per entry. Changes submitted while a write of the same entry is
+    waiting for a worker or running are merged into the next write. The
+    optimistic value of an entry is kept until its last write is done.
+
+    :param executor: :class:`concurrent.futures.Executor` instance
+    :param write: Callable writing an entry, called with the entry key
+                  and its changes (:func:`list`)
+    :param failed: Callable called with entry key, changes and exception
+                   when a write fails (optional)
+    """
+
+    def __init__(self, executor, write, failed=None):
+        """Init method"""
+        self._executor = executor
+        self._write = write
+        self._failed = failed
+        self._idle = threading.Condition()
+        self._queued = {}
+        self._running = set()
+        self._optimistic = {}
+
+    def submit(self, key, change, optimistic=None):
+        """Queue a change
+
+        :param key: Entry key
+        :param change: Change passed to ``write``
+        :param optimistic: Entry value once changed (optional)
+        :return: :obj:`True` if change was merged in a queued write
+        """
+        with self._idle:
+            if optimistic is not None:
+                self._optimistic[key] = optimistic
+            merged = key in self._queued
+            self._queued.setdefault(key, []).append(change)
+            if key not in self._running:
+                try:
+                    self._executor.submit(self._run, key)
+                except RuntimeError:
+                    # Executor is shut down
+                    del self._queued[key]
+                    self._optimistic.pop(key, None)
+                    raise
+                self._running.add(key)
+        return merged
+
+    def _run(self, key):
+        """Write queued changes of an entry"""
+        with self._idle:
+            changes = self._queued.pop(key)
+        try:
+            self._write(key, changes)
+        except Exception as exc:
+            self._report(key, changes, exc)
+        finally:
+            self._next(key)
+
+    def _next(self, key):
+        """Write changes queued meanwhile or release entry"""
+        dropped = None
+        with self._idle:
+            if key in self._queued:
+                try:
+                    self._executor.submit(self._run, key)
+                    return
+                except RuntimeError as exc:
+                    # Executor is shut down, queued changes are dropped
+                    dropped = (self._queued.pop(key), exc)
+            self._running.discard(key)
+            self._optimistic.pop(key, None)
+            self._idle.notify_all()
+        if dropped is not None:
+            self._report(key, *dropped)
+
+    def _report(self, key, changes, exc):
+        """Call failure callback, its own errors are logged"""
+        if self._failed is None:
+            return
+        try:
+            self._failed(key, changes, exc)
+        except Exception:
+            log.exception("Failure callback of %s write failed", key)
+
+    def pending(self, key):
+        """Get optimistic value of an entry with pending writes
+
+        :param key: Entry key
+        :return: Last submitted optimistic value or :obj:`None`
+        """
+        with self._idle:
+            return self._optimistic.get(key)
+
+    def join(self, timeout=None):
+        """Wait for pending writes
+
+        :param float timeout: Maximum waiting time in seconds (optional)
+        :return: :obj:`True` if no write is pending
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._running, timeout)
@@ -0,0 +1,352 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+from .models import Incident
+from .search import IncidentSearchIndex
+
+# Sorted views keys are (timestamp << ID_BITS | incident ID) integers
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+# Incidents requested per page on full rebuilds
+REBUILD_PAGE_SIZE = 500
+
+
+def is_scheduled(incident):
+    """Tell if incident is a scheduled maintenance
+
+    :param incident: :class:`~cachet.models.Incident`
+    :return: :obj:`True` if incident is scheduled
+    """
+    return incident.status == 0
+
+
+def is_active(incident):
+    """Tell if incident is still open
+
+    :param incident: :class:`~cachet.models.Incident`
+    :return: :obj:`True` unless incident is scheduled or fixed
+    """
+    return incident.status not in (0, 4)
+
+
+def match_incident(regex, incident):
+    """Tell if incident name or message matches a regular expression
+
+    :param regex: Compiled regular expression
+    :param incident: :class:`~cachet.models.Incident`
+    :return: :obj:`True` if incident matches
+    """
+    return bool(regex.search(incident.name) or
+                regex.search(incident.message))
+
+
+class IncidentIndex(object):
+    """Local incident index with sorted views
+
+    Incidents are split in two views, sorted keys are kept up to date with
+    :mod:`bisect` so top-N and date range queries never sort the whole
+    list:
+
+    - unscheduled incidents sorted by ``created_at``
+    - scheduled maintenances sorted by ``scheduled_at``
+
+    Incidents are :class:`~cachet.models.Incident` records, their dates
+    are parsed once when fetched. Views are compact arrays of integer keys
+    packing the date timestamp and the incident ID.
+
+    Incident names and messages are also indexed in :attr:`text`, a
+    :class:`~cachet.search.IncidentSearchIndex` kept in sync with the views.
+    Active incidents are mapped to their component. :attr:`version` is
+    replaced by a new object on each change.
+
+    The index is refreshed incrementally by fetching incidents ordered by
+    ``updated_at`` until the last known update is reached. A full rebuild
+    is done every ``rebuild_interval`` seconds to catch deleted incidents,
+    into a new index swapped in once complete so readers never see a
+    partial index.
+
+    :param dict state: Index state as returned by :meth:`dump` (optional)
+    :param int rebuild_interval: Full rebuild interval in seconds
+    """
+
+    def __init__(self, state=None, rebuild_interval=3600):
+        """Init method"""
+        self.rebuild_interval = rebuild_interval
+        self.incidents = {}
+        self.watermark = ''
+        self.rebuilt_at = 0
+        self.refreshed_at = 0
+        self.version = object()
+        self._lock = threading.RLock()
+        self._active = {}
+        self._keys = {}
+        self._unscheduled = array('Q')
+        self._scheduled = array('Q')
+        self.text = IncidentSearchIndex()
+        if state:
+            self.watermark = state['watermark']
+            self.rebuilt_at = state['rebuilt_at']
+            self.refreshed_at = state.get('refreshed_at', self.rebuilt_at)
+            for incident in state['incidents']:
+                self.upsert(Incident.load(incident))
+
+    def dump(self):
+        """Dump index state for persistence
+
+        :return: Index state (:func:`dict`)
+        """
+        return {'incidents': [incident.dump()
+                              for incident in self.incidents.values()],
+                'watermark': self.watermark,
+                'rebuilt_at': self.rebuilt_at,
+                'refreshed_at': self.refreshed_at}
+
+    @staticmethod
+    def _sort_key(incident):
+        """Get incident key in its sorted view"""
+        if is_scheduled(incident):
+            return (incident.scheduled_ts << ID_BITS) | incident.id
+        return (incident.created_ts << ID_BITS) | incident.id
+
+    def _get(self, keys):
+        """Get incidents of view keys"""
+        with self._lock:
+            return [self.incidents[key & ID_MASK] for key in keys]
+
+    def _view(self, incident):
+        """Get sorted view of incident"""
+        if is_scheduled(incident):
+            return self._scheduled
+        return self._unscheduled
+
+    def _unchanged(self, incident):
+        """Tell if incident is indexed with the same values"""
+        known = self.incidents.get(incident.id)
+        return known is not None and known.dump() == incident.dump()
+
+    def upsert(self, incident, advance=False):
+        """Insert or update an incident
+
+        Incidents already indexed with the same values are skipped. Only
+        incidents fetched by :meth:`refresh` advance the watermark, local
+        writes would otherwise hide older remote changes.
+
+        :param incident: :class:`~cachet.models.Incident`
+        :param bool advance: Advance watermark to incident update date
+        :return: :obj:`True` if index changed
+        """
+        iid = incident.id
+        with self._lock:
+            if advance and incident.updated_at > self.watermark:
+                self.watermark = incident.updated_at
+            if self._unchanged(incident):
+                return False
+            self.remove(iid)
+            key = self._sort_key(incident)
+            view = self._view(incident)
+            insort(view, key)
+            self._keys[iid] = (view, key)
+            self.incidents[iid] = incident
+            self.text.add(incident)
+            cid = incident.component_id
+            if cid and is_active(incident):
+                self._active.setdefault(cid, set()).add(iid)
+            self.version = object()
+            return True
+
+    def remove(self, iid):
+        """Remove an incident from index
+
+        :param int iid: Incident ID
+        """
+        with self._lock:
+            entry = self._keys.pop(iid, None)
+            if entry is None:
+                return
+            view, key = entry
+            del view[bisect_left(view, key)]
+            incident = self.incidents.pop(iid)
+            self.text.remove(iid)
+            cid = incident.component_id
+            if iid in self._active.get(cid, ()):
+                self._active[cid].discard(iid)
+                if not self._active[cid]:
+                    del self._active[cid]
+            self.version = object()
+
+    def _swap(self, index):
+        """Replace indexed incidents by those of another index
+
+        :param index: Fully built :class:`IncidentIndex`
+        :return: Number of added, updated or removed incidents
+                 (:func:`int`)
+        """
+        with self._lock:
+            changed = sum(1 for incident in index.incidents.values()
+                          if not self._unchanged(incident))
+            changed += sum(1 for iid in self.incidents
+                           if iid not in index.incidents)
+            self.incidents = index.incidents
+            self.watermark = index.watermark
+            self._keys = index._keys
+            self._unscheduled = index._unscheduled
+            self._scheduled = index._scheduled
+            self._active = index._active
+            self.text = index.text
+            if changed:
+                self.version = object()
+            return changed
+
+    def refresh(self, fetch):
+        """Refresh index from API
+
+        :param fetch: Callable accepting API search parameters and returning
+                      :class:`~cachet.models.Incident` records
+        :return: Number of added, updated or removed incidents (:func:`int`)
+        """
+        if time.time() - self.rebuilt_at > self.rebuild_interval:
+            index = IncidentIndex(rebuild_interval=self.rebuild_interval)
+            for incident in fetch(sort='updated_at', order='desc',
+                                  per_page=REBUILD_PAGE_SIZE):
+                index.upsert(incident, advance=True)
+            changed = self._swap(index)
+            self.rebuilt_at = self.refreshed_at = time.time()
+            return changed
+
+        fetched = []
+        for incident in fetch(sort='updated_at', order='desc'):
+            # Incidents updated on the same second as the watermark are
+            # fetched again, they are skipped by upsert when unchanged
+            if incident.updated_at < self.watermark:
+                break
+            fetched.append(incident)
+
+        changed = 0
+        for incident in fetched:
+            changed += self.upsert(incident, advance=True)
+        self.refreshed_at = time.time()
+        return changed
+
+    def get(self, iid):
+        """Get an indexed incident
+
+        :param int iid: Incident ID
+        :return: :class:`~cachet.models.Incident` or :obj:`None`
+        """
+        with self._lock:
+            return self.incidents.get(int(iid))
+
+    def active(self, cid):
+        """Get active incidents of a component
+
+        :param int cid: Component ID
+        :return: Incidents, newest first (:func:`list`)
+        """
+        with self._lock:
+            iids = sorted(self._active.get(int(cid), ()), reverse=True)
+            return [self.incidents[iid] for iid in iids]
+
+    def active_counts(self):
+        """Get active incidents count by component
+
+        :return: :func:`dict` of counts by component ID
+        """
+        with self._lock:
+            return {cid: len(iids) for cid, iids in self._active.items()}
+
+    def last(self, num, start=None, end=None):
+        """Get last unscheduled incidents
+
+        :param int num: Number of incidents
+        :param int start: Oldest creation UNIX timestamp (optional)
+        :param int end: Newest creation UNIX timestamp (optional)
+        :return: Incidents, newest first (:func:`list`)
+        """
+        if num <= 0:
+            return []
+        with self._lock:
+            view = self._unscheduled
+            low = 0 if start is None else bisect_left(view, start << ID_BITS)
+            high = len(view)
+            if end is not None:
+                high = bisect_right(view, (end << ID_BITS) | ID_MASK)
+            return self._get(reversed(view[max(low, high - num):high]))
+
+    def upcoming(self, now, num):
+        """Get upcoming maintenances
+
+        :param int now: Current UNIX timestamp
+        :param int num: Number of maintenances
+        :return: Maintenances, soonest first (:func:`list`)
+        """
+        if num <= 0:
+            return []
+        with self._lock:
+            view = self._scheduled
+            low = bisect_right(view, (now << ID_BITS) | ID_MASK)
+            return self._get(view[low:low + num])
+
+    def past(self, now, num):
+        """Get past maintenances
+
+        :param int now: Current UNIX timestamp
+        :param int num: Number of maintenances
+        :return: Maintenances, latest first (:func:`list`)
+        """
+        if num <= 0:
+            return []
+        with self._lock:
+            view = self._scheduled
+            high = bisect_right(view, (now << ID_BITS) | ID_MASK)
+            return self._get(reversed(view[max(0, high - num):high]))
+
+    def search(self, text, num):
+        """Search incidents by name and message
+
+        :param str text: Search text
+        :param int num: Number of incidents
+        :return: Matching incidents, newest first (:func:`list`)
+        """
+        with self._lock:
+            found = heapq.nlargest(num, self.text.search(text))
+            return [self.incidents[iid] for iid in found]
+
+    def search_regex(self, regex, num):
+        """Search incidents matching a regular expression
+
+        :param regex: Compiled regular expression
+        :param int num: Number of incidents
+        :return: Matching incidents, newest first (:func:`list`)
+        """
+        found = []
+        with self._lock:
+            for iid in sorted(self.incidents, reverse=True):
+                if len(found) >= num:
+                    break
+                if match_incident(regex, self.incidents[iid]):
+                    found.append(self.incidents[iid])
+        return found
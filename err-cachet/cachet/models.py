@@ -0,0 +1,176 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""Compact records of Cachet API entries
+
+API entries are decoded once, when they are fetched. Only the fields used
+by the plugin are kept, statuses and IDs are converted to integers and
+incident dates are parsed to UNIX timestamps. Records are dumped to lists
+of values for persistence.
+"""
+
+from .utils import parse_date
+
+
+class Model(object):
+    """Record with fixed fields
+
+    Record fields are the class ``__slots__``, in constructor arguments
+    order. Subclasses define a ``from_api`` class method decoding API
+    entries.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        """Init method"""
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        """Record representation"""
+        return "<%s %s: %s>" % (self.__class__.__name__, self.id, self.name)
+
+    def dump(self):
+        """Dump record values
+
+        :return: JSON serializable values (:func:`list`)
+        """
+        return [getattr(self, name) for name in self.__slots__]
+
+    def replace(self, **values):
+        """Get a copy of record with changed fields
+
+        :return: Record instance
+        """
+        record = self.__class__(*self.dump())
+        for name, value in values.items():
+            setattr(record, name, value)
+        return record
+
+    @classmethod
+    def load(cls, values):
+        """Load record dumped by :meth:`dump`
+
+        :param list values: Record values
+        :return: Record instance
+        """
+        return cls(*values)
+
+
+class Component(Model):
+    """Cachet component
+
+    ``group_id`` is 0 for components out of any group.
+    """
+
+    __slots__ = ('id', 'name', 'status', 'status_name', 'group_id', 'link',
+                 'description', 'updated_at')
+
+    @classmethod
+    def from_api(cls, data):
+        """Decode API component
+
+        :param dict data: Component data
+        :return: :class:`Component`
+        """
+        return cls(int(data['id']), data['name'],
+                   int(data.get('status') or 0),
+                   data.get('status_name') or '',
+                   int(data.get('group_id') or 0),
+                   data.get('link') or '',
+                   data.get('description') or '',
+                   data.get('updated_at') or '')
+
+
+class ComponentGroup(Model):
+    """Cachet component group"""
+
+    __slots__ = ('id', 'name')
+
+    @classmethod
+    def from_api(cls, data):
+        """Decode API component group
+
+        :param dict data: Component group data
+        :return: :class:`ComponentGroup`
+        """
+        return cls(int(data['id']), data['name'])
+
+
+class Incident(Model):
+    """Cachet incident
+
+    ``component_id`` is 0 for incidents impacting no component. Dates are
+    kept as returned by the API for display, ``created_ts`` and
+    ``scheduled_ts`` are their UNIX timestamps, 0 for invalid dates.
+    """
+
+    __slots__ = ('id', 'name', 'status', 'human_status', 'component_id',
+                 'message', 'created_at', 'updated_at', 'scheduled_at',
+                 'created_ts', 'scheduled_ts')
+
+    @classmethod
+    def from_api(cls, data):
+        """Decode API incident
+
+        :param dict data: Incident data
+        :return: :class:`Incident`
+        """
+        created_at = data.get('created_at') or ''
+        scheduled_at = data.get('scheduled_at') or ''
+        return cls(int(data['id']), data['name'],
+                   int(data.get('status') or 0),
+                   data.get('human_status') or '',
+                   int(data.get('component_id') or 0),
+                   data.get('message') or '',
+                   created_at, data.get('updated_at') or '', scheduled_at,
+                   max(parse_date(created_at) or 0, 0),
+                   max(parse_date(scheduled_at) or 0, 0))
+
+
+class IncidentUpdate(Model):
+    """Cachet incident update
+
+    Updates are listed by Cachet 2.4 API or parsed from incident messages,
+    see :mod:`cachet.updates`. ``id`` and ``status`` are 0 for parsed
+    updates, ``human_status`` is then their header status text.
+    """
+
+    __slots__ = ('id', 'incident_id', 'status', 'human_status', 'message',
+                 'created_at')
+
+    def __repr__(self):
+        """Record representation"""
+        return "<%s %s: %s>" % (self.__class__.__name__, self.incident_id,
+                                self.created_at)
+
+    @classmethod
+    def from_api(cls, data):
+        """Decode API incident update
+
+        :param dict data: Incident update data
+        :return: :class:`IncidentUpdate`
+        """
+        return cls(int(data['id']), int(data.get('incident_id') or 0),
+                   int(data.get('status') or 0),
+                   data.get('human_status') or '',
+                   data.get('message') or '',
+                   data.get('created_at') or '')
@@ -21,6 +21,8 @@
 from datetime import datetime
 from inspect import cleandoc
 
+from .. import utils
+
 
 COMPONENT_VIEW = """
 **Component**: `%s` %s
@@ -84,4 +86,151 @@ def unknown_component(cid):
     return cleandoc("""
         :warning: Unknown component id %s.
         Try `component list all` to find your component.
-    """ % cid)
\ No newline at end of file
+    """ % cid)
+
+
+def update_failed(iid, exc):
+    """Get failed incident update error message
+
+    :param int iid: Incident ID
+    :param exc: Raised exception
+    :return: Error message (:class:`str`)
+    """
+    return ":x: Update of incident %s failed: %s" % (iid, exc)
+
+
+def unknown_group(gid):
+    """Get unknown component group error message
+
+    :param int gid: Component group ID
+    :return: Error message (:class:`str`)
+    """
+    return cleandoc("""
+        :warning: Unknown group id %s.
+        Try `component list groups` to find your group.
+    """ % gid)
+
+
+def groups_status(groups, statuses):
+    """Build component groups health overview
+
+    Groups with affected components are listed first, worst first, then
+    in groups order.
+
+    :param list groups: :class:`~cachet.models.ComponentGroup` records
+    :param dict statuses: :class:`~cachet.rollup.GroupStatus` by group ID
+    :return: :func:`tuple` (overview (:class:`str`),
+             worst status (:func:`int`))
+    """
+    names = {group.id: group.name for group in groups}
+    names[0] = "Ungrouped components"
+    order = {group.id: idx for idx, group in enumerate(groups)}
+    listed = sorted(statuses.values(), key=lambda status: (
+        -status.worst_status, order.get(status.gid, len(order))))
+
+    worst_status = 1
+    reply = ["Groups status:"]
+    for status in listed:
+        worst_status = max(worst_status, status.worst_status)
+        line = "-  `%d`  **%s**: %s %s, %d/%d components affected" % (
+            status.gid, names.get(status.gid, "Unknown group"),
+            utils.ICONS[status.worst_status],
+            status.worst_name, status.degraded, len(status.components))
+        if status.affected:
+            line += " (%s)" % ", ".join(
+                "`%d` %s" % (component.id, component.name)
+                for component in status.affected)
+        reply.append(line)
+    if len(reply) == 1:
+        reply.append("No component found")
+    return "\n".join(reply), worst_status
+
+
+def incident_updates(updates, iid, num, page):
+    """Build a page of incident update log
+
+    :param list updates: :class:`~cachet.models.IncidentUpdate` records,
+                         newest first
+    :param int iid: Incident ID
+    :param int num: Number of updates per page
+    :param int page: Page number, 1 for latest updates
+    :return: Listing lines (:func:`list`)
+    """
+    num = max(num, 1)
+    pages = max(1, -(-len(updates) // num))
+    page = min(max(page, 1), pages)
+    reply = ["**Updates** (page %d/%d):" % (page, pages)]
+    for update in updates[(page - 1) * num:page * num]:
+        line = "_%s_" % update.created_at
+        if update.human_status:
+            line += " **%s**" % update.human_status
+        reply.extend([line, update.message])
+    if page < pages:
+        reply.append("_Older updates:_ `!cachet inci show %s --page %d`" % (
+            iid, page + 1))
+    return reply
+
+
+def stale_data(timestamp):
+    """Get stale data warning
+
+    :param float timestamp: Data UNIX timestamp
+    :return: Warning message (:class:`str`)
+    """
+    return ":warning: _Cachet is unavailable, data as of %s_" % (
+        datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def components_problems(components, active_counts=None):
+    """Build components problems listing
+
+    :param list components: :class:`~cachet.models.Component` records
+    :param dict active_counts: Active incidents count by component ID
+                               (optional)
+    :return: :func:`tuple` (listing (:class:`str`),
+             worst status (:func:`int`))
+    """
+    worst_status = 1
+    reply = ["Components problems:"]
+    for component in components:
+        c_status = component.status
+        if c_status > 1:
+            if c_status > worst_status:
+                worst_status = c_status
+            line = "-  `%d`  %s: %s %s" % (
+                component.id, component.name,
+                utils.ICONS[c_status], component.status_name)
+            count = (active_counts or {}).get(component.id)
+            if count:
+                line += " (%d active incident%s)" % (
+                    count, "s" if count > 1 else "")
+            reply.append(line)
+    if len(reply) == 1:
+        reply.append(":ok: Everything is fine")
+    return "\n".join(reply), worst_status
+
+
+def components_list(components):
+    """Build components listing
+
+    :param list components: :class:`~cachet.models.Component` records
+    :return: Listing (:class:`str`)
+    """
+    reply = ["Available components:"]
+    for component in components:
+        reply.append("-  `%d`  **%s**: %s %s" % (
+            component.id, component.name,
+            utils.ICONS[component.status], component.status_name))
+    return "\n".join(reply)
+
+
+def groups_list(groups):
+    """Build component groups listing
+
+    :param list groups: :class:`~cachet.models.ComponentGroup` records
+    :return: Listing (:class:`str`)
+    """
+    reply = ["Available groups:"]
+    for group in groups:
+        reply.append("-  `%d`  **%s**" % (group.id, group.name))
+    return "\n".join(reply)
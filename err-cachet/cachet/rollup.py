@@ -0,0 +1,70 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+
+class GroupStatus(object):
+    """Health of a component group
+
+    Components with a status above operational are affected, the worst
+    status is operational for a group without affected component.
+
+    :param int gid: Group ID, 0 for components out of any group
+    """
+
+    __slots__ = ('gid', 'components', 'affected', 'worst_status',
+                 'worst_name')
+
+    def __init__(self, gid):
+        """Init method"""
+        self.gid = gid
+        self.components = []
+        self.affected = []
+        self.worst_status = 1
+        self.worst_name = "Operational"
+
+    @property
+    def degraded(self):
+        """Number of affected components"""
+        return len(self.affected)
+
+
+def rollup(components, groups=()):
+    """Build component groups health in a single pass over components
+
+    Given groups are listed even without components.
+
+    :param list components: :class:`~cachet.models.Component` records
+    :param list groups: :class:`~cachet.models.ComponentGroup` records
+                        (optional)
+    :return: :class:`GroupStatus` by group ID (:func:`dict`)
+    """
+    groups = {group.id: GroupStatus(group.id) for group in groups}
+    for component in components:
+        group = groups.get(component.group_id)
+        if group is None:
+            group = groups[component.group_id] = GroupStatus(
+                component.group_id)
+        group.components.append(component)
+        if component.status > 1:
+            group.affected.append(component)
+            if component.status > group.worst_status:
+                group.worst_status = component.status
+                group.worst_name = component.status_name
+    return groups
@@ -0,0 +1,271 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import re
+import heapq
+from bisect import bisect_left
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Minimal trigram similarity for fuzzy matches
+FUZZY_THRESHOLD = 0.4
+
+# Match scores by query token, higher is better
+SCORE_NAME = 100
+SCORE_TOKEN = 60
+SCORE_PREFIX = 50
+SCORE_SUBSTRING = 40
+SCORE_FUZZY = 30
+SCORE_DESCRIPTION = 10
+
+
+def tokenize(text):
+    """Split text in lower case tokens
+
+    :param str text: Text to split
+    :return: Tokens (:func:`list`)
+    """
+    return TOKEN_RE.findall((text or "").lower())
+
+
+def match_text(text, incident):
+    """Tell if incident matches a search text
+
+    Same rule as :meth:`IncidentSearchIndex.search`, for incidents out of
+    the index: every query token must be found in incident name or
+    message, the last query token may be a prefix.
+
+    :param str text: Search text
+    :param incident: :class:`~cachet.models.Incident`
+    :return: :obj:`True` if incident matches
+    """
+    query = tokenize(text)
+    if not query:
+        return False
+    tokens = set(tokenize(incident.name))
+    tokens.update(tokenize(incident.message))
+    return (all(token in tokens for token in query[:-1]) and
+            any(token.startswith(query[-1]) for token in tokens))
+
+
+def trigrams(token):
+    """Get trigrams of a token
+
+    Token is padded with spaces so short tokens still produce trigrams.
+
+    :param str token: Token
+    :return: Trigrams (:func:`set`)
+    """
+    padded = "  %s " % token
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
+class ComponentSearchIndex(object):
+    """Inverted index over component names and descriptions
+
+    Component names and descriptions are split in tokens pointing to
+    components. Query tokens are expanded over the names vocabulary:
+    prefixes by bisection over the sorted vocabulary, substrings and fuzzy
+    matches through a trigram index of the vocabulary. Lookups never scan
+    the components list.
+
+    :param list components: :class:`~cachet.models.Component` records
+    """
+
+    def __init__(self, components):
+        """Init method"""
+        self.components = {}
+        self._names = {}
+        self._name_tokens = defaultdict(set)
+        self._desc_tokens = defaultdict(set)
+        self._vocabulary_trigrams = defaultdict(set)
+
+        for component in components:
+            cid = component.id
+            tokens = tokenize(component.name)
+            self.components[cid] = component
+            self._names[cid] = " ".join(tokens)
+            for token in tokens:
+                self._name_tokens[token].add(cid)
+            for token in tokenize(component.description):
+                self._desc_tokens[token].add(cid)
+
+        self._vocabulary = sorted(self._name_tokens)
+        for token in self._vocabulary:
+            for trigram in trigrams(token):
+                self._vocabulary_trigrams[trigram].add(token)
+
+    def _prefixed(self, prefix):
+        """Get vocabulary tokens starting with prefix"""
+        idx = bisect_left(self._vocabulary, prefix)
+        while idx < len(self._vocabulary):
+            token = self._vocabulary[idx]
+            if not token.startswith(prefix):
+                break
+            yield token
+            idx += 1
+
+    def _containing(self, text):
+        """Get vocabulary tokens containing text"""
+        if len(text) < 3:
+            candidates = self._vocabulary
+        else:
+            candidates = set.intersection(*[
+                self._vocabulary_trigrams.get(text[idx:idx + 3], set())
+                for idx in range(len(text) - 2)])
+        return [token for token in candidates if text in token]
+
+    def _similar(self, text):
+        """Get vocabulary tokens similar to text with their similarity"""
+        query = trigrams(text)
+        shared = defaultdict(int)
+        for trigram in query:
+            for token in self._vocabulary_trigrams.get(trigram, ()):
+                shared[token] += 1
+        for token, count in shared.items():
+            union = len(query) + len(token) + 1 - count
+            yield token, count / union
+
+    def _token_scores(self, text):
+        """Get best score of components matching a query token"""
+        scores = defaultdict(int)
+
+        def score(tokens, value, postings=self._name_tokens):
+            for token in tokens:
+                for cid in postings.get(token, ()):
+                    if scores[cid] < value:
+                        scores[cid] = value
+
+        score([text], SCORE_DESCRIPTION, self._desc_tokens)
+        for token, ratio in self._similar(text):
+            if ratio >= FUZZY_THRESHOLD:
+                score([token], int(SCORE_FUZZY * ratio))
+        score(self._containing(text), SCORE_SUBSTRING)
+        score(self._prefixed(text), SCORE_PREFIX)
+        score([text], SCORE_TOKEN)
+        return scores
+
+    def search(self, text, limit=None):
+        """Search components
+
+        Every query token must match component name or description.
+
+        :param str text: Search text
+        :param int limit: Maximum number of results (optional)
+        :return: Matching components, best match first (:func:`list`)
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+
+        scores = None
+        for token in tokens:
+            token_scores = self._token_scores(token)
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {cid: value + token_scores[cid]
+                          for cid, value in scores.items()
+                          if cid in token_scores}
+
+        query = " ".join(tokens)
+        for cid in self._name_tokens.get(tokens[0], ()):
+            if cid in scores and self._names[cid] == query:
+                scores[cid] += SCORE_NAME
+
+        def rank(cid):
+            return -scores[cid], self._names[cid]
+
+        if limit is None:
+            ranked = sorted(scores, key=rank)
+        else:
+            ranked = heapq.nsmallest(limit, scores, key=rank)
+        return [self.components[cid] for cid in ranked]
+
+
+class IncidentSearchIndex(object):
+    """Inverted index over incident names and messages
+
+    The index is updated incrementally with :meth:`add` and :meth:`remove`
+    as incidents change. Every query token must be found in incident name
+    or message, the last query token may be a prefix.
+    """
+
+    def __init__(self):
+        """Init method"""
+        self._postings = defaultdict(set)
+        self._tokens = {}
+        self._vocabulary = None
+
+    def add(self, incident):
+        """Index an incident, replacing previous version if any
+
+        :param incident: :class:`~cachet.models.Incident`
+        """
+        iid = incident.id
+        self.remove(iid)
+        tokens = set(tokenize(incident.name))
+        tokens.update(tokenize(incident.message))
+        for token in tokens:
+            if token not in self._postings:
+                self._vocabulary = None
+            self._postings[token].add(iid)
+        self._tokens[iid] = tokens
+
+    def remove(self, iid):
+        """Remove an incident from index
+
+        :param int iid: Incident ID
+        """
+        for token in self._tokens.pop(iid, ()):
+            postings = self._postings[token]
+            postings.discard(iid)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary = None
+
+    def _prefixed(self, prefix):
+        """Get incidents with a token starting with prefix"""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        found = set()
+        idx = bisect_left(self._vocabulary, prefix)
+        while idx < len(self._vocabulary):
+            token = self._vocabulary[idx]
+            if not token.startswith(prefix):
+                break
+            found |= self._postings[token]
+            idx += 1
+        return found
+
+    def search(self, text):
+        """Search incidents
+
+        :param str text: Search text
+        :return: Matching incident IDs (:func:`set`)
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return set()
+        found = self._prefixed(tokens[-1])
+        for token in tokens[:-1]:
+            found &= self._postings.get(token, set())
+        return found
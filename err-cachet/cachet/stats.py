@@ -0,0 +1,198 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import re
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+
+# Latency histogram buckets upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+API_PATH_RE = re.compile(r'^.*?/api/v\d+/')
+API_ID_RE = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_name(method, url):
+    """Get endpoint name of an API request
+
+    Entries IDs are replaced so requests are grouped by endpoint.
+
+    :param str method: HTTP method
+    :param str url: Request URL
+    :return: Endpoint name, e.g. ``GET incidents/:id`` (:class:`str`)
+    """
+    path = API_PATH_RE.sub('', url.split('?')[0])
+    return "%s %s" % (method, API_ID_RE.sub('/:id', '/' + path)[1:])
+
+
+class Metric(object):
+    """Calls count, errors, latency histogram and received bytes"""
+
+    def __init__(self):
+        """Init method"""
+        self.count = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.received = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, duration, error=False, received=0):
+        """Record a call"""
+        self.count += 1
+        self.errors += int(error)
+        self.duration += duration
+        self.received += received
+        self.buckets[bisect_left(BUCKETS, duration)] += 1
+
+    def percentile(self, ratio):
+        """Get latency percentile upper bound from histogram
+
+        :param float ratio: Percentile ratio, e.g. 0.95
+        :return: Bucket upper bound in seconds, :obj:`None` if above all
+        """
+        threshold = ratio * self.count
+        cumulated = 0
+        for idx, count in enumerate(self.buckets):
+            cumulated += count
+            if cumulated >= threshold:
+                return BUCKETS[idx] if idx < len(BUCKETS) else None
+        return None
+
+
+class Stats(object):
+    """Commands and Cachet API calls statistics"""
+
+    def __init__(self):
+        """Init method"""
+        self._lock = threading.Lock()
+        self.commands = {}
+        self.endpoints = {}
+
+    def _observe(self, metrics, name, duration, error, received):
+        """Record a call in metrics"""
+        with self._lock:
+            if name not in metrics:
+                metrics[name] = Metric()
+            metrics[name].observe(duration, error, received)
+
+    def observe_command(self, name, duration, error=False):
+        """Record a bot command call
+
+        :param str name: Command name
+        :param float duration: Call duration in seconds
+        :param bool error: Whether the command raised an error
+        """
+        self._observe(self.commands, name, duration, error, 0)
+
+    def observe_request(self, name, duration, error=False, received=0):
+        """Record a Cachet API request
+
+        :param str name: Endpoint name
+        :param float duration: Request duration in seconds
+        :param bool error: Whether the request failed
+        :param int received: Received bytes
+        """
+        self._observe(self.endpoints, name, duration, error, received)
+
+    def report(self):
+        """Get human readable statistics
+
+        :return: Report lines (:func:`list`)
+        """
+        lines = []
+        for title, metrics in (("Commands:", self.commands),
+                               ("Cachet API:", self.endpoints)):
+            lines.append(title)
+            with self._lock:
+                items = sorted(metrics.items())
+            for name, metric in items:
+                p95 = metric.percentile(0.95)
+                line = "-  `%s`  %d calls, %d errors, avg %.1f ms, " % (
+                    name, metric.count, metric.errors,
+                    1000 * metric.duration / metric.count)
+                if p95 is None:
+                    line += "p95 > %d ms" % (1000 * BUCKETS[-1])
+                else:
+                    line += "p95 < %d ms" % (1000 * p95)
+                if metrics is self.endpoints:
+                    line += ", %.1f KiB received" % (metric.received / 1024)
+                lines.append(line)
+            if not items:
+                lines.append("No call recorded")
+        return lines
+
+    def prometheus(self):
+        """Get statistics in Prometheus text exposition format
+
+        :return: Metrics text (:class:`str`)
+        """
+        lines = []
+        for prefix, label, metrics in (
+                ('cachet_command', 'command', self.commands),
+                ('cachet_api_request', 'endpoint', self.endpoints)):
+            with self._lock:
+                items = sorted(metrics.items())
+            lines.append("# TYPE %s_duration_seconds histogram" % prefix)
+            for name, metric in items:
+                cumulated = 0
+                for idx, bound in enumerate(BUCKETS + ('+Inf',)):
+                    cumulated += metric.buckets[idx]
+                    lines.append('%s_duration_seconds_bucket{%s="%s",le="%s"}'
+                                 ' %d' % (prefix, label, name, bound,
+                                          cumulated))
+                lines.append('%s_duration_seconds_sum{%s="%s"} %f' % (
+                    prefix, label, name, metric.duration))
+                lines.append('%s_duration_seconds_count{%s="%s"} %d' % (
+                    prefix, label, name, metric.count))
+            lines.append("# TYPE %s_errors_total counter" % prefix)
+            for name, metric in items:
+                lines.append('%s_errors_total{%s="%s"} %d' % (
+                    prefix, label, name, metric.errors))
+            if metrics is self.endpoints:
+                lines.append("# TYPE %s_received_bytes_total counter" %
+                             prefix)
+                for name, metric in items:
+                    lines.append('%s_received_bytes_total{%s="%s"} %d' % (
+                        prefix, label, name, metric.received))
+        return "\n".join(lines)
+
+
+def timed(func):
+    """Record bot command calls in plugin's :class:`Stats`
+
+    Decorated methods must belong to a plugin with a ``stats`` attribute.
+    Command name is the method name without the ``cachet_`` prefix.
+    """
+    name = func.__name__.replace('cachet_', '', 1)
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        error = True
+        try:
+            result = func(self, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            self.stats.observe_command(name, time.perf_counter() - started,
+                                       error)
+    return wrapper
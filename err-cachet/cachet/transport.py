@@ -0,0 +1,341 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache import Flight
+from .stats import endpoint_name
+
+# Statuses worth a retry: throttling and server side errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Incident creation is not idempotent and is never retried
+RETRY_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+# Number of responses kept for conditional requests
+VALIDATED_RESPONSES = 256
+
+
+class JitteredRetry(Retry):
+    """Exponential retry with full jitter
+
+    Backoff time is drawn between zero and the exponential backoff, so
+    several bot instances do not retry in lockstep on an unhealthy API.
+    ``Retry-After`` headers sent with 429 and 503 responses are honored.
+    Retries run inside the connection pool, each one takes a token of
+    ``limiter`` once its backoff is over.
+
+    :param limiter: :class:`TokenBucket` instance (optional)
+
+    Other arguments are transmitted to :class:`urllib3.util.retry.Retry`.
+    """
+
+    def __init__(self, *args, limiter=None, **kwargs):
+        """Init method"""
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+
+    def new(self, **kwargs):
+        """Get retry state of the next attempt, sharing the limiter"""
+        retry = super().new(**kwargs)
+        retry.limiter = self.limiter
+        return retry
+
+    def get_backoff_time(self):
+        """Get jittered backoff time"""
+        return random.uniform(0, super().get_backoff_time())
+
+    def sleep(self, response=None):
+        """Wait for backoff, then for a rate limiter token"""
+        super().sleep(response)
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter
+
+    Callers exceeding the rate wait for their turn, bursts of up to
+    ``burst`` calls are let through without waiting.
+
+    :param float rate: Calls per second
+    :param int burst: Bucket capacity, defaults to one second of calls
+    """
+
+    def __init__(self, rate, burst=None):
+        """Init method"""
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for it if the bucket is empty
+
+        :return: Waited time in seconds (:func:`float`)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens are reserved, waiting callers are served in order
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Request not sent, Cachet API is considered unhealthy"""
+
+
+class CircuitBreaker(object):
+    """Circuit breaker for an unhealthy API
+
+    The circuit opens after ``threshold`` consecutive failures and no
+    request is allowed for ``cooldown`` seconds. A single trial request is
+    then allowed, the circuit is closed again if it succeeds.
+
+    :param int threshold: Consecutive failures opening the circuit
+    :param float cooldown: Open circuit duration in seconds
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        """Init method"""
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Tell if a request may be sent
+
+        :return: :obj:`False` while the circuit is open
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            # Trial request, others wait for another cooldown
+            self.opened_at = time.monotonic()
+            return True
+
+    def record(self, success):
+        """Record a request result
+
+        :param bool success: Whether the API answered properly
+        """
+        with self._lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class ConditionalSession(requests.Session):
+    """HTTP session revalidating and coalescing GET responses
+
+    Validators (``ETag`` and ``Last-Modified`` headers) of GET responses are
+    remembered and sent back as ``If-None-Match`` and ``If-Modified-Since``
+    headers. When the server answers ``304 Not Modified``, the previous
+    response is returned with its already parsed JSON payload.
+
+    Identical GET requests issued while one is in flight share its
+    response. Requests are throttled by :attr:`limiter` when set, and not
+    sent while :attr:`breaker` circuit is open.
+
+    :param int max_responses: Number of responses kept for revalidation
+    :param limiter: :class:`TokenBucket` instance (optional)
+    :param breaker: :class:`CircuitBreaker` instance (optional)
+    """
+
+    def __init__(self, max_responses=VALIDATED_RESPONSES, limiter=None,
+                 breaker=None):
+        """Init method"""
+        super().__init__()
+        self.max_responses = max_responses
+        self.limiter = limiter
+        self.breaker = breaker
+        self._responses = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, *args, **kwargs):
+        """Send request, conditionally for known GET responses"""
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError("Cachet API circuit is open, "
+                                   "request not sent: %s %s" % (method, url))
+        if method.upper() != 'GET':
+            if self.limiter is not None:
+                self.limiter.acquire()
+            return super().request(method, url, *args, **kwargs)
+
+        key = (url, kwargs.get('data'), repr(kwargs.get('params')))
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Flight()
+        if not leader:
+            return flight.wait()
+
+        try:
+            response = self._conditional_get(key, url, *args, **kwargs)
+        except Exception as exc:
+            with self._lock:
+                del self._inflight[key]
+            flight.done(error=exc)
+            raise
+        with self._lock:
+            del self._inflight[key]
+        flight.done(response)
+        return response
+
+    def send(self, request, **kwargs):
+        """Send prepared request and record its result in circuit breaker"""
+        if self.breaker is None:
+            return super().send(request, **kwargs)
+        try:
+            response = super().send(request, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record(False)
+            raise
+        self.breaker.record(response.status_code not in RETRY_STATUSES)
+        return response
+
+    def _conditional_get(self, key, url, *args, **kwargs):
+        """Send GET request with validators of previous response"""
+        with self._lock:
+            cached = self._responses.get(key)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if cached is not None:
+            if 'ETag' in cached.headers:
+                headers['If-None-Match'] = cached.headers['ETag']
+            if 'Last-Modified' in cached.headers:
+                headers['If-Modified-Since'] = cached.headers['Last-Modified']
+
+        if self.limiter is not None:
+            self.limiter.acquire()
+        response = super().request('GET', url, *args, headers=headers,
+                                   **kwargs)
+        if response.status_code == 304 and cached is not None:
+            return cached
+
+        if response.ok and ('ETag' in response.headers or
+                            'Last-Modified' in response.headers):
+            try:
+                payload = response.json()
+            except ValueError:
+                return response
+            response.json = lambda **json_kwargs: payload
+            with self._lock:
+                self._responses[key] = response
+                self._responses.move_to_end(key)
+                while len(self._responses) > self.max_responses:
+                    self._responses.popitem(last=False)
+        return response
+
+
+class InstrumentedSession(ConditionalSession):
+    """Conditional HTTP session recording requests statistics
+
+    Requests actually sent to the API are recorded, retries included, with
+    their latency, received bytes and failures.
+
+    :param stats: :class:`~cachet.stats.Stats` instance
+    """
+
+    def __init__(self, stats, *args, **kwargs):
+        """Init method"""
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+
+    def send(self, request, **kwargs):
+        """Send prepared request and record it"""
+        name = endpoint_name(request.method, request.url)
+        started = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.exceptions.RequestException:
+            self.stats.observe_request(name, time.perf_counter() - started,
+                                       error=True)
+            raise
+        self.stats.observe_request(name, time.perf_counter() - started,
+                                   error=response.status_code >= 400,
+                                   received=len(response.content))
+        return response
+
+
+def build_session(pool_size=10, retries=3, backoff_factor=0.5, stats=None,
+                  rate_limit=0, rate_burst=None, circuit_threshold=0,
+                  circuit_cooldown=30):
+    """Build a pooled keep-alive HTTP session
+
+    Returned session is a :class:`ConditionalSession`, instrumented if a
+    :class:`~cachet.stats.Stats` instance is given.
+
+    :param int pool_size: Number of pooled connections per host
+    :param int retries: Maximum number of retries on failure
+    :param float backoff_factor: Exponential backoff factor in seconds
+    :param stats: :class:`~cachet.stats.Stats` instance (optional)
+    :param float rate_limit: Requests per second, 0 for no limit
+    :param int rate_burst: Requests allowed in a burst (optional)
+    :param int circuit_threshold: Consecutive failures opening the circuit,
+                                  0 for no circuit breaker
+    :param float circuit_cooldown: Open circuit duration in seconds
+    :return: :class:`requests.Session`
+    """
+    limiter = TokenBucket(rate_limit, rate_burst) if rate_limit else None
+    retry = JitteredRetry(total=retries,
+                          backoff_factor=backoff_factor,
+                          status_forcelist=RETRY_STATUSES,
+                          allowed_methods=RETRY_METHODS,
+                          raise_on_status=False,
+                          limiter=limiter)
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+    breaker = None
+    if circuit_threshold:
+        breaker = CircuitBreaker(circuit_threshold, circuit_cooldown)
+    if stats is not None:
+        session = InstrumentedSession(stats, limiter=limiter,
+                                      breaker=breaker)
+    else:
+        session = ConditionalSession(limiter=limiter, breaker=breaker)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
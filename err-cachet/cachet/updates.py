@@ -0,0 +1,91 @@
+#
+#    ErrBot plugin for Cachet (err-cachet)
+#
+#    Copyright (C) 2017 Denis Pompilio (jawa) <denis.pompilio@gmail.com>
+#
+#    This file is part of err-cachet
+#
+#    This program is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU General Public License
+#    as published by the Free Software Foundation; either version 2
+#    of the License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""Incident update logs
+
+Cachet 2.3 has no incident updates, they are prepended to the incident
+message by the plugin, each one after a header line and before a
+separator (see :func:`cachet.resources.views.message_header`). Cachet 2.4
+lists incident updates on their own endpoint. Both are merged in a single
+update log.
+"""
+
+import re
+
+from .models import IncidentUpdate
+
+HEADER_RE = re.compile(r'^#{5} \[(?P<date>[^\]]*)\] ?(?P<status>.*)$')
+SEPARATOR_RE = re.compile(r'\n\n---\n')
+VERSION_RE = re.compile(r'^v?(\d+)\.(\d+)')
+
+# First Cachet version with incident updates endpoint
+UPDATES_VERSION = (2, 4)
+
+
+def parse_version(version):
+    """Parse Cachet version
+
+    :param str version: Version, e.g. ``2.3.10`` or ``2.4.0-dev``
+    :return: :func:`tuple` (major, minor), (0, 0) if version is invalid
+    """
+    match = VERSION_RE.match(version or '')
+    if match is None:
+        return (0, 0)
+    return tuple(int(field) for field in match.groups())
+
+
+def parse_message(incident):
+    """Parse updates prepended to an incident message
+
+    Message parts without header, such as the incident description, are
+    dated from incident creation.
+
+    :param incident: :class:`~cachet.models.Incident`
+    :return: :class:`~cachet.models.IncidentUpdate` records, newest first
+             (:func:`list`)
+    """
+    updates = []
+    for part in SEPARATOR_RE.split(incident.message):
+        if not part.strip():
+            continue
+        header, _, body = part.partition('\n')
+        match = HEADER_RE.match(header)
+        if match is None:
+            date, status, body = incident.created_at, '', part
+        else:
+            date, status = match.group('date'), match.group('status')
+        # Headers dates have microseconds, API dates do not
+        updates.append(IncidentUpdate(0, incident.id, 0, status.strip(),
+                                      body.strip('\n'), date[:19]))
+    return updates
+
+
+def update_log(incident, updates=()):
+    """Get update log of an incident
+
+    :param incident: :class:`~cachet.models.Incident`
+    :param updates: :class:`~cachet.models.IncidentUpdate` records listed
+                    by the API (optional)
+    :return: :class:`~cachet.models.IncidentUpdate` records, newest first
+             (:func:`list`)
+    """
+    log = list(updates) + parse_message(incident)
+    log.sort(key=lambda update: update.created_at, reverse=True)
+    return log
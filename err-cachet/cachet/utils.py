@@ -19,47 +19,99 @@
 #    along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 import re
+import time
+import importlib
+
+DATE_RE = r'(\d{4})-(\d\d)-(\d\d)'
+TIME_RE = r'(\d\d):(\d\d)(?::(\d\d)(?:Z|[+-]\d\d:\d\d)?)?'
+DATETIME_RE = r'^%s(?:[ T]%s)?$' % (DATE_RE, TIME_RE)
+DATETIME_PATTERN = re.compile(DATETIME_RE)
+PERIOD_SEPARATOR = '>'
 
 
-def pmatch(word, min_chars=4):
-    """Return regexp to match first letters of a word
+def normalize_status(status):
+    """Normalize status alias for lookups
 
-    Example with the word "components":
-      comp(?:o(?:n(?:e(?:n(?:t(?:s)?)?)?)?)?)?
+    Case and spaces are ignored, so ``Partial Outage`` and ``partialoutage``
+    are the same alias.
+
+    :param str status: Status alias
+    :return: Normalized alias (:class:`str`)
     """
-    regex = word[0:min_chars]
-    word_len = len(word)
-    for char in word[min_chars:]:
-        regex += "(?:" + char
-    regex += ")?" * (word_len - min_chars)
-    return regex
+    return ''.join(str(status).split()).lower()
 
 
-DATE_RE = r'(\d{4})-(\d\d)-(\d\d)'
-TIME_RE = r'(\d\d):(\d\d)(?::(\d\d)(?:Z|[+-]\d\d:\d\d)?)?'
-DATETIME_RE = r'^%s(?:[ T]%s)?$' % (DATE_RE, TIME_RE)
+class StatusResolver(object):
+    """Status aliases resolver
+
+    Every accepted alias is computed once into a dictionary: status names
+    and their prefixes of at least ``min_chars`` characters, numeric
+    statuses and explicit aliases. Explicit aliases and names take
+    precedence over prefixes.
+
+    :param statuses: Statuses definitions as (status (:func:`int`),
+                     name (:class:`str`), min_chars (:func:`int` or
+                     :obj:`None` for no prefix), aliases) tuples
+    """
+
+    def __init__(self, statuses):
+        """Init method"""
+        self.statuses = tuple(statuses)
+        self._aliases = {}
+        for status, name, min_chars, _ in self.statuses:
+            if min_chars:
+                key = normalize_status(name)
+                for length in range(min_chars, len(key)):
+                    self._aliases.setdefault(key[:length], (status, name))
+        for status, name, _, aliases in self.statuses:
+            for alias in (str(status), name) + tuple(aliases):
+                self._aliases[normalize_status(alias)] = (status, name)
+
+    def resolve(self, status):
+        """Get status info
+
+        :param str status: Status alias
+        :return: :func:`tuple` (status (:func:`int`), name (:func:`str`))
+                 or :obj:`None`
+        """
+        return self._aliases.get(normalize_status(status))
 
-CACHET_INCIDENT_STATUS = {
-    re.compile(pmatch("investigating", 3),
-               re.IGNORECASE): (1, "Investigating"),
-    re.compile(pmatch("identified", 2),
-               re.IGNORECASE): (2, "Identified"),
-    re.compile(pmatch("watching", 2),
-               re.IGNORECASE): (3, "Watching"),
-    re.compile(pmatch("fixed", 3),
-               re.IGNORECASE): (4, "Fixed")
-}
-
-CACHET_COMPONENT_STATUS = {
-    re.compile(r'^(green|op|operational)$',
-               re.IGNORECASE): (1, "Operational"),
-    re.compile(r'^(blue|pi|Performance ?Issues)$',
-               re.IGNORECASE): (2, "Performance Issues"),
-    re.compile(r'^(orange|po|Partial ?Outage)$',
-               re.IGNORECASE): (3, "Partial Outage"),
-    re.compile(r'^(red|mo|Major ?Outage)$',
-               re.IGNORECASE): (4, "Major Outage")
-}
+    def extend(self, aliases):
+        """Get a resolver with additional aliases
+
+        :param dict aliases: Targeted status alias by new alias
+        :return: :class:`StatusResolver` instance
+        :raises ValueError: if an alias targets an unknown status
+        """
+        extra = {}
+        for alias, target in aliases.items():
+            info = self.resolve(target)
+            if info is None:
+                raise ValueError("Unknown status for alias %s: %s"
+                                 % (alias, target))
+            extra.setdefault(info[0], []).append(alias)
+        return StatusResolver(
+            (status, name, min_chars,
+             tuple(status_aliases) + tuple(extra.get(status, ())))
+            for status, name, min_chars, status_aliases in self.statuses)
+
+
+INCIDENT_STATUS = StatusResolver((
+    (1, "Investigating", 3, ()),
+    (2, "Identified", 2, ()),
+    (3, "Watching", 2, ()),
+    (4, "Fixed", 3, ()),
+))
+
+COMPONENT_STATUS = StatusResolver((
+    (1, "Operational", None, ('green', 'op')),
+    (2, "Performance Issues", None, ('blue', 'pi')),
+    (3, "Partial Outage", None, ('orange', 'po')),
+    (4, "Major Outage", None, ('red', 'mo')),
+))
+
+TARGET_RANGE_RE = re.compile(r'^(\d+)-(\d+)$')
+TARGET_GROUP_RE = re.compile(r'^g:(\d+)$', re.IGNORECASE)
 
 # Icons by component status
 ICONS = [
@@ -80,17 +132,85 @@ COLORS = [
 ]
 
 
+class LazyModule(object):
+    """Module imported on first attribute access
+
+    Heavy dependencies are only imported when actually used, which keeps
+    bot startup fast.
+
+    :param str name: Absolute module name
+    """
+
+    def __init__(self, name):
+        """Init method"""
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        """Import module and get its attribute"""
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+def parse_date(date):
+    """Parse a Cachet or user date
+
+    Dates are read in local time, as Cachet dates are. Timezone offsets
+    are ignored.
+
+    :param str date: Date, e.g. ``2017-07-21 18:48:28`` or ``2017-07-21``
+    :return: UNIX timestamp (:func:`int`) or :obj:`None` if date is invalid
+    """
+    match = DATETIME_PATTERN.match(date or '')
+    if match is None:
+        return None
+    fields = [int(field or 0) for field in match.groups()]
+    return int(time.mktime(tuple(fields) + (0, 0, -1)))
+
+
+def parse_period(period):
+    """Parse a period
+
+    Both dates are optional. An end date without time includes its whole
+    day.
+
+    :param str period: Period, e.g. ``2017-07-01>2017-07-21 12:00``
+    :return: :func:`tuple` (start, end) UNIX timestamps, :obj:`None` for
+             unbounded sides
+    :raise: :class:`ValueError` if period is invalid
+    """
+    if PERIOD_SEPARATOR not in period:
+        raise ValueError("Period must be formatted as [date]>[date]")
+    start, end = [date.strip() for date in period.split(PERIOD_SEPARATOR, 1)]
+    bounds = []
+    for date in (start, end):
+        timestamp = parse_date(date) if date else None
+        if date and timestamp is None:
+            raise ValueError("Invalid date: %s" % date)
+        bounds.append(timestamp)
+    if bounds[1] is not None and ':' not in end:
+        bounds[1] += 86399
+    return tuple(bounds)
+
+
+def first(entries):
+    """Get first entry of an iterable without consuming the rest
+
+    :param entries: Iterable, such as pylls results generators
+    :return: First entry or :obj:`None` if iterable is empty
+    """
+    return next(iter(entries), None)
+
+
 def get_istatus(istatus):
     """Return incident status info
 
-    :param cstatus: Component status alias
+    :param istatus: Incident status alias
     :return: :func:`tuple` (status (:func:`int`), name (:func:`str`))
              or :obj:`None`
     """
-    for regex, numeric_status in CACHET_INCIDENT_STATUS.items():
-        if regex.search(istatus):
-            return numeric_status
-    return None
+    return INCIDENT_STATUS.resolve(istatus)
 
 
 def get_cstatus(cstatus):
@@ -100,7 +220,89 @@ def get_cstatus(cstatus):
     :return: :func:`tuple` (status (:func:`int`), name (:func:`str`))
              or :obj:`None`
     """
-    for regex, numeric_status in CACHET_COMPONENT_STATUS.items():
-        if regex.search(cstatus):
-            return numeric_status
-    return None
+    return COMPONENT_STATUS.resolve(cstatus)
+
+
+def chunk_lines(lines, max_size):
+    """Group lines in chunks of limited size
+
+    Chunks are built lazily and split at line boundaries, only lines
+    longer than ``max_size`` are cut.
+
+    :param lines: Iterable of lines without line feeds
+    :param int max_size: Maximum chunk size in characters
+    :return: Generator of chunks (:class:`str`)
+    """
+    chunk = []
+    size = 0
+    for line in lines:
+        while len(line) > max_size:
+            if chunk:
+                yield "\n".join(chunk)
+                chunk, size = [], 0
+            yield line[:max_size]
+            line = line[max_size:]
+        if chunk and size + 1 + len(line) > max_size:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+        size += len(line) + (1 if chunk else 0)
+        chunk.append(line)
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def diff_statuses(previous, current):
+    """Compute components status changes
+
+    :param dict previous: Previous status by component ID
+    :param dict current: Current status by component ID
+    :return: :func:`list` of (component ID, previous status, current status)
+             tuples sorted by component ID, missing statuses are
+             :obj:`None`
+    """
+    changes = []
+    for cid in sorted(set(previous) | set(current)):
+        old, new = previous.get(cid), current.get(cid)
+        if old != new:
+            changes.append((cid, old, new))
+    return changes
+
+
+def parse_targets(targets, max_span=None):
+    """Parse components targets specification
+
+    Targets are comma separated, each one may be a component ID (``12``),
+    an inclusive ID range (``3-7``), a group ID (``g:4``) or a regular
+    expression matched against component names. Ranges are not expanded.
+
+    :param str targets: Targets specification
+    :param int max_span: Maximum number of IDs in a range (optional)
+    :return: :func:`tuple` (component IDs (:func:`set`), inclusive ID
+             ranges (:func:`list` of (start, end) tuples), group IDs
+             (:func:`set`), name patterns (:func:`list`))
+    :raise: :class:`ValueError` on invalid range, :class:`re.error` on
+            invalid name pattern
+    """
+    ids, ranges, groups, patterns = set(), [], set(), []
+    for target in targets.split(','):
+        target = target.strip()
+        if not target:
+            continue
+        id_range = TARGET_RANGE_RE.match(target)
+        group = TARGET_GROUP_RE.match(target)
+        if target.isdigit():
+            ids.add(int(target))
+        elif id_range:
+            start, end = int(id_range.group(1)), int(id_range.group(2))
+            if end < start:
+                raise ValueError("range end is lower than its start: %s" %
+                                 target)
+            if max_span is not None and end - start + 1 > max_span:
+                raise ValueError("range is larger than %d IDs: %s" %
+                                 (max_span, target))
+            ranges.append((start, end))
+        elif group:
+            groups.add(int(group.group(1)))
+        else:
+            patterns.append(re.compile(target, re.IGNORECASE))
+    return ids, ranges, groups, patterns
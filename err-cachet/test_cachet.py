@@ -19,6 +19,32 @@
 #    along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from cachet import CONFIG_DEFAULTS, Cachet
+from cachet.backends import SQLiteBackend, StorageBackend
+from cachet.cache import (RenderCache, SnapshotCache, UpdateLogCache,
+                          VersionedFetch)
+from cachet.executor import MutationQueue, RequestBatch
+from cachet.index import IncidentIndex
+from cachet.models import Component, ComponentGroup, Incident, IncidentUpdate
+from cachet.resources import views
+from cachet.rollup import rollup
+from cachet.search import ComponentSearchIndex, match_text
+from cachet.stats import Stats, endpoint_name
+from cachet.transport import (CircuitBreaker, ConditionalSession,
+                              JitteredRetry, TokenBucket)
+from cachet.updates import parse_version, update_log
+from cachet.utils import (COMPONENT_STATUS, INCIDENT_STATUS, chunk_lines,
+                          diff_statuses, parse_date, parse_period,
+                          parse_targets)
 
 pytest_plugins = ["errbot.backends.test"]
 extra_plugin_dir = '.'
@@ -32,6 +58,617 @@ CONFIG = {'api_endpoint': 'https://status/api/v1',
           'api_token': 'XXXXXXXXXXXXXXXXXXXXX'}
 
 
+def test_snapshot_cache():
+    """Test snapshot cache TTL, stampede protection and invalidation"""
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        return len(calls)
+
+    cache = SnapshotCache(ttl=60)
+    threads = [threading.Thread(target=cache.get, args=('key', fetch))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert cache.get('key', fetch) == 1
+    cache.invalidate('key')
+    assert cache.get('key', fetch) == 2
+
+
+def test_shared_snapshot_cache(tmp_path):
+    """Test snapshots sharing through a SQLite backend"""
+    path = str(tmp_path / 'cache.sqlite')
+    first = SnapshotCache(ttl=60, backend=SQLiteBackend(path))
+    second = SnapshotCache(ttl=60, backend=SQLiteBackend(path))
+    assert first.get('components', lambda: [{'id': 1}]) == [{'id': 1}]
+    assert second.get('components', lambda: []) == [{'id': 1}]
+    assert second.get('local', lambda: 'b', shared=False) == 'b'
+    assert first.get('local', lambda: 'a', shared=False) == 'a'
+    second.invalidate('components', shared=False)
+    assert second.get('components', lambda: []) == [{'id': 1}]
+    second.invalidate('components')
+    assert first.backend.stamp('components') is None
+    assert second.get('components', lambda: [{'id': 2}]) == [{'id': 2}]
+
+    first.invalidate('components')
+    second.invalidate('components')
+    component = Component.from_api({'id': '3', 'name': 'DNS',
+                                    'status': '2', 'group_id': None})
+    assert first.get('components', lambda: [component],
+                     model=Component) == [component]
+    shared = second.get('components', lambda: [], model=Component)
+    assert shared[0].dump() == [3, 'DNS', 2, '', 0, '', '', '']
+
+
+def test_storage_backend():
+    """Test snapshots storage time read apart from snapshots"""
+    storage = {}
+    backend = StorageBackend(storage)
+    assert backend.stamp('incident_index') is None
+    backend.store('incident_index', 12.5, {'incidents': []})
+    assert backend.stamp('incident_index') == 12.5
+    assert backend.load('incident_index') == (12.5, {'incidents': []})
+    backend.delete('incident_index')
+    assert storage == {}
+
+
+def test_token_bucket():
+    """Test rate limiter bursts and throttling"""
+    bucket = TokenBucket(rate=50, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert 0.01 < bucket.acquire() <= 0.02
+
+    # Retries inside the connection pool take tokens too
+    bucket = TokenBucket(rate=50, burst=1)
+    retry = JitteredRetry(total=3, backoff_factor=0, limiter=bucket).new()
+    assert retry.limiter is bucket
+    retry.sleep()
+    assert bucket.acquire() > 0.01
+
+
+def test_request_coalescing():
+    """Test identical in-flight GET requests sharing a response"""
+    calls = []
+
+    class SlowAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            calls.append(request.url)
+            time.sleep(0.05)
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b'{}'
+            response.request = request
+            return response
+
+    session = ConditionalSession()
+    session.mount('http://', SlowAdapter())
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        responses = list(executor.map(
+            lambda _: session.get('http://cachet/api/v1/components/1'),
+            range(5)))
+    assert len(calls) == 1
+    assert all(response is responses[0] for response in responses)
+    session.get('http://cachet/api/v1/components/1')
+    assert len(calls) == 2
+
+
+def test_conditional_session():
+    """Test GET responses revalidation with validators"""
+    sent = []
+
+    class ValidatingAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            sent.append(dict(request.headers))
+            response = requests.Response()
+            response.request = request
+            if request.headers.get('If-None-Match') == '"v1"':
+                response.status_code = 304
+                return response
+            response.status_code = 200
+            response.headers['ETag'] = '"v1"'
+            response.headers['Last-Modified'] = 'Sat, 01 Jul 2017 10:00:00 GMT'
+            response._content = b'{"data": [1]}'
+            return response
+
+    session = ConditionalSession()
+    session.mount('http://', ValidatingAdapter())
+    url = 'http://cachet/api/v1/components'
+    first = session.get(url)
+    payload = first.json()
+    assert 'If-None-Match' not in sent[0]
+    second = session.get(url)
+    assert sent[1]['If-None-Match'] == '"v1"'
+    assert sent[1]['If-Modified-Since'] == 'Sat, 01 Jul 2017 10:00:00 GMT'
+    assert second is first
+    assert second.json() is payload
+
+
+def test_versioned_fetch():
+    """Test data reused while its version is unchanged"""
+    version, fetches = ['v1'], []
+
+    def fetch():
+        fetches.append(version[0])
+        return [version[0]]
+
+    versioned = VersionedFetch(lambda: version[0], fetch)
+    value = versioned()
+    assert versioned() is value
+    version[0] = 'v2'
+    assert versioned() == ['v2']
+    versioned.reset()
+    assert versioned() == ['v2']
+    assert fetches == ['v1', 'v2', 'v2']
+    versioned.max_age = 0
+    versioned()
+    assert len(fetches) == 4
+
+
+def test_stale_snapshot_cache():
+    """Test stale snapshots served past latency budget or on failure"""
+    cache = SnapshotCache(ttl=0, budget=0.05)
+    assert cache.get('key', lambda: 'fresh') == 'fresh'
+    assert cache.stale_since() is None
+
+    def slow():
+        time.sleep(0.2)
+        return 'late'
+
+    assert cache.get('key', slow) == 'fresh'
+    assert cache.stale_since() is not None
+    assert cache.stale_since('key', 'other') is not None
+    assert cache.stale_since('other') is None
+    time.sleep(0.3)
+    assert cache.stale_since() is None
+
+    def fail():
+        raise IOError("Cachet is down")
+
+    assert cache.get('key', fail) == 'late'
+    with pytest.raises(IOError):
+        cache.get('other', fail)
+    assert cache.get('other', fail, restore=lambda: (0, 'old')) == 'old'
+
+
+def test_circuit_breaker():
+    """Test circuit opening on failures and closing after a trial"""
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.allow()
+
+
+def test_render_cache():
+    """Test rendered replies memoization on snapshot version"""
+    cache = RenderCache(max_entries=2)
+    renders = []
+
+    def render(text):
+        renders.append(text)
+        return text
+
+    components, groups = [1], [2]
+    sources = {'components': components}
+    assert cache.get(('a',), sources, lambda: render('a1')) == 'a1'
+    assert cache.get(('a',), sources, lambda: render('a2')) == 'a1'
+    cache.get(('b',), {'groups': groups}, lambda: render('b1'))
+    assert cache.get(('a',), {'components': [1]},
+                     lambda: render('a3')) == 'a3'
+    assert cache.get(('b',), {'groups': groups},
+                     lambda: render('b2')) == 'b1'
+    cache.get(('c',), {'groups': groups}, lambda: render('c1'))
+    assert len(cache) == 2
+    assert renders == ['a1', 'b1', 'a3', 'c1']
+
+
+def test_request_batch():
+    """Test concurrent requests deduplication"""
+    calls = []
+
+    def fetch(entry_id, **params):
+        calls.append(entry_id)
+        return iter([entry_id])
+
+    batch = RequestBatch(ThreadPoolExecutor(max_workers=2))
+    first = batch.submit(fetch, 1, sort='id')
+    assert batch.submit(fetch, 1, sort='id') is first
+    assert batch.submit(fetch, 2).result() == [2]
+    assert first.result() == [1]
+    assert sorted(calls) == [1, 2]
+
+
+def test_mutation_queue():
+    """Test background writes merging and optimistic values"""
+    started, release = threading.Event(), threading.Event()
+    writes, failures = [], []
+
+    def write(key, changes):
+        writes.append((key, changes))
+        started.set()
+        release.wait(1)
+        if 'fail' in changes:
+            raise IOError("Cachet is down")
+
+    queue = MutationQueue(ThreadPoolExecutor(max_workers=2), write,
+                          lambda *args: failures.append(args))
+    assert not queue.submit(1, 'a', optimistic='A')
+    started.wait(1)
+    assert not queue.submit(1, 'b')
+    assert queue.submit(1, 'c', optimistic='C')
+    assert queue.pending(1) == 'C'
+    release.set()
+    assert queue.join(1)
+    assert writes == [(1, ['a']), (1, ['b', 'c'])]
+    assert queue.pending(1) is None
+
+    queue.submit(2, 'fail')
+    assert queue.join(1)
+    assert failures[0][:2] == (2, ['fail'])
+
+    def failed(key, changes, exc):
+        raise IOError("Chat is down")
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    queue = MutationQueue(executor, write, failed)
+    queue.submit(3, 'fail', optimistic='F')
+    assert queue.join(1)
+    assert queue.pending(3) is None
+    queue.submit(3, 'd')
+    assert queue.join(1)
+    assert writes[-1] == (3, ['d'])
+
+    release.clear()
+    started.clear()
+    queue.submit(4, 'e', optimistic='E')
+    started.wait(1)
+    queue.submit(4, 'f')
+    executor.shutdown(wait=False)
+    release.set()
+    assert queue.join(1)
+    assert queue.pending(4) is None
+
+
+def test_group_rollup():
+    """Test component groups health rollup"""
+    components = [Component.from_api(data) for data in (
+        {'id': 1, 'name': 'DNS', 'status': '1', 'group_id': '2'},
+        {'id': 2, 'name': 'NAS', 'status': '3', 'group_id': '4',
+         'status_name': 'Partial Outage'},
+        {'id': 3, 'name': 'SAN', 'status': '2', 'group_id': '4',
+         'status_name': 'Performance Issues'},
+        {'id': 4, 'name': 'Mail', 'status': '1'},
+    )]
+    statuses = rollup(components)
+    assert sorted(statuses) == [0, 2, 4]
+    assert statuses[4].worst_status == 3
+    assert [component.id for component in statuses[4].affected] == [2, 3]
+    assert statuses[2].degraded == 0
+
+    groups = [ComponentGroup(2, 'Network'), ComponentGroup(4, 'Storage'),
+              ComponentGroup(6, 'Empty')]
+    statuses = rollup(components, groups)
+    body, worst_status = views.groups_status(groups, statuses)
+    assert worst_status == 3
+    assert body.split("\n")[1:] == [
+        "-  `4`  **Storage**: :warning: Partial Outage, "
+        "2/2 components affected (`2` NAS, `3` SAN)",
+        "-  `2`  **Network**: :ok: Operational, 0/1 components affected",
+        "-  `6`  **Empty**: :ok: Operational, 0/0 components affected",
+        "-  `0`  **Ungrouped components**: :ok: Operational, "
+        "0/1 components affected"]
+
+
+def test_update_log():
+    """Test incident update log parsing, merging and paging"""
+    incident = Incident.from_api({
+        'id': 4, 'name': 'NAS failure', 'created_at': '2017-01-01 10:00:00',
+        'message': "\n".join([
+            '##### [2017-01-02 10:00:00.123456] Fixed: Operational', 'Done',
+            views.updates_separator(), 'Storage is slow.'])})
+    api = IncidentUpdate.from_api({
+        'id': 9, 'incident_id': 4, 'status': '2', 'human_status': 'Identified',
+        'message': 'Disk failure', 'created_at': '2017-01-01 12:00:00'})
+    log = update_log(incident, [api])
+    assert [(update.created_at, update.human_status) for update in log] == [
+        ('2017-01-02 10:00:00', 'Fixed: Operational'),
+        ('2017-01-01 12:00:00', 'Identified'),
+        ('2017-01-01 10:00:00', '')]
+    assert log[0].message == 'Done'
+    assert log[2].message == 'Storage is slow.'
+
+    page = views.incident_updates(log, 4, 2, 1)
+    assert page[0] == "**Updates** (page 1/2):"
+    assert '--page 2' in page[-1]
+    assert views.incident_updates(log, 4, 2, 5)[-1] == 'Storage is slow.'
+
+    assert parse_version('2.4.0-dev') == (2, 4)
+    assert parse_version('') == (0, 0)
+
+    cache, loads = UpdateLogCache(max_entries=1), []
+    assert cache.get(4, 'v1', lambda: loads.append(1) or log) is log
+    cache.get(4, 'v1', lambda: loads.append(2))
+    cache.get(4, 'v2', lambda: loads.append(3))
+    assert loads == [1, 3]
+
+
+def test_incident_index():
+    """Test incident index incremental refresh and sorted views"""
+    incidents = [
+        {'id': 1, 'status': '1', 'name': 'DNS failure', 'component_id': '7',
+         'message': 'Resolvers down', 'created_at': '2017-01-01 10:00:00',
+         'updated_at': '2017-01-01 10:00:00'},
+        {'id': 2, 'status': '0', 'name': 'DNS upgrade',
+         'message': '', 'created_at': '2017-01-02 10:00:00',
+         'scheduled_at': '2017-02-01 10:00:00',
+         'updated_at': '2017-01-02 10:00:00'},
+        {'id': 3, 'status': '4', 'name': 'Storage failure',
+         'component_id': '7', 'message': '',
+         'created_at': '2017-01-03 10:00:00',
+         'updated_at': '2017-01-03 10:00:00'},
+    ]
+
+    def fetch(**params):
+        return [Incident.from_api(ent)
+                for ent in sorted(incidents, key=lambda ent: ent['updated_at'],
+                                  reverse=True)]
+
+    index = IncidentIndex()
+    assert index.refresh(fetch) == 3
+    assert [ent.id for ent in index.last(5)] == [3, 1]
+    day = parse_date('2017-01-15')
+    assert [ent.id for ent in index.upcoming(day, 5)] == [2]
+    assert index.past(day, 5) == []
+    later = parse_date('2017-03-01')
+    assert [ent.id for ent in index.past(later, 5)] == [2]
+    assert [ent.id for ent in index.last(5, end=day - 86400 * 13)] == [1]
+    assert index.incidents[2].scheduled_ts == parse_date('2017-02-01 10:00')
+    assert [ent.id for ent in index.search('failure', 5)] == [3, 1]
+    assert [ent.id for ent in index.search('dns resolv', 5)] == [1]
+    assert match_text('dns resolv', index.incidents[1])
+    assert not match_text('resolv dns', index.incidents[1])
+    assert index.search('ailure', 5) == []
+    assert not match_text('ailure', index.incidents[1])
+
+    # Incidents updated at the watermark date are fetched again, unchanged
+    # ones are not counted
+    version = index.version
+    assert index.refresh(fetch) == 0
+    assert index.version is version
+    incidents[0] = dict(incidents[0], updated_at='2017-01-04 10:00:00')
+    assert index.refresh(fetch) == 1
+    index = IncidentIndex(index.dump())
+    assert [ent.id for ent in index.last(1)] == [3]
+    assert [ent.id for ent in index.active(7)] == [1]
+    assert index.active_counts() == {7: 1}
+
+    version = index.version
+    index.upsert(Incident.from_api(
+        dict(incidents[2], status='2', updated_at='2017-01-05')))
+    assert [ent.id for ent in index.active(7)] == [3, 1]
+    index.upsert(Incident.from_api(
+        dict(incidents[0], status='4', updated_at='2017-01-05')))
+    assert index.active_counts() == {7: 1}
+    assert index.version is not version
+
+
+def test_incident_index_local_writes():
+    """Test local writes not hiding older remote changes"""
+    incidents = {iid: {'id': iid, 'status': '1', 'name': 'Incident %d' % iid,
+                       'created_at': '2017-01-01 10:00:00',
+                       'updated_at': '2017-01-01 10:00:00'}
+                 for iid in (1, 2)}
+
+    def fetch(**params):
+        return [Incident.from_api(ent)
+                for ent in sorted(incidents.values(),
+                                  key=lambda ent: ent['updated_at'],
+                                  reverse=True)]
+
+    index = IncidentIndex()
+    assert index.refresh(fetch) == 2
+    incidents[1] = dict(incidents[1], name='Remote rename',
+                        updated_at='2017-01-02 10:00:00')
+    incidents[2] = dict(incidents[2], name='Local rename',
+                        updated_at='2017-01-03 10:00:00')
+    index.upsert(Incident.from_api(incidents[2]))
+    assert index.refresh(fetch) == 1
+    assert index.get(1).name == 'Remote rename'
+    assert index.refresh(fetch) == 0
+
+
+def test_incident_index_rebuild():
+    """Test full rebuilds keeping the index readable until complete"""
+    incidents = [Incident.from_api({
+        'id': iid, 'status': '1', 'name': 'Incident %d' % iid,
+        'created_at': '2017-01-0%d 10:00:00' % iid,
+        'updated_at': '2017-01-0%d 10:00:00' % iid}) for iid in (1, 2, 3)]
+    index = IncidentIndex(rebuild_interval=0)
+    assert index.refresh(lambda **params: incidents) == 3
+    seen, pages = [], []
+
+    def fetch(**params):
+        pages.append(params['per_page'])
+        for incident in incidents[:2]:
+            seen.append([ent.id for ent in index.last(5)])
+            yield incident
+
+    assert index.refresh(fetch) == 1
+    assert seen == [[3, 2, 1], [3, 2, 1]]
+    assert [ent.id for ent in index.last(5)] == [2, 1]
+    assert pages == [500]
+
+    def fail(**params):
+        raise IOError("Cachet is down")
+
+    with pytest.raises(IOError):
+        index.refresh(fail)
+    assert [ent.id for ent in index.last(5)] == [2, 1]
+
+
+def test_component_search_index():
+    """Test component search ranking"""
+    index = ComponentSearchIndex([Component.from_api(data) for data in (
+        {'id': 1, 'name': 'DNS Master', 'description': 'Primary DNS'},
+        {'id': 2, 'name': 'DNS', 'description': ''},
+        {'id': 3, 'name': 'Storage NAS', 'description': 'Datacenter A'},
+    )])
+    assert [ent.id for ent in index.search('dns')] == [2, 1]
+    assert [ent.id for ent in index.search('dns mast')] == [1]
+    assert [ent.id for ent in index.search('torag')] == [3]
+    assert [ent.id for ent in index.search('strage')] == [3]
+    assert [ent.id for ent in index.search('datacenter')] == [3]
+    assert index.search('unknown') == []
+
+
+def test_diff_statuses():
+    """Test components status changes computation"""
+    previous = {1: (1, 'Operational'), 2: (1, 'Operational'),
+                3: (4, 'Major Outage')}
+    current = {1: (1, 'Operational'), 2: (3, 'Partial Outage'),
+               4: (1, 'Operational')}
+    assert diff_statuses(previous, previous) == []
+    assert diff_statuses(previous, current) == [
+        (2, (1, 'Operational'), (3, 'Partial Outage')),
+        (3, (4, 'Major Outage'), None),
+        (4, None, (1, 'Operational'))]
+
+
+def test_poll_components():
+    """Test components status changes pushed to configured rooms"""
+    bot = SimpleNamespace(repo_manager=SimpleNamespace(plugin_dir='.'))
+    plugin = Cachet(bot, 'Cachet')
+    plugin.config = dict(CONFIG_DEFAULTS, poll_rooms=['#ops', '#noc'])
+    plugin._cache = SnapshotCache(ttl=60)
+    components = [{'id': 1, 'name': 'DNS', 'status': 1,
+                   'status_name': 'Operational'}]
+    plugin._fetch_components = lambda: [Component.from_api(data)
+                                        for data in components]
+    cards = []
+    plugin.build_identifier = lambda room: room
+    plugin.send_card = lambda **card: cards.append(card)
+
+    plugin.poll_components()
+    plugin.poll_components()
+    assert cards == []
+    components[0] = dict(components[0], status=4,
+                         status_name='Major Outage')
+    plugin.poll_components()
+    assert [card['to'] for card in cards] == ['#ops', '#noc']
+    assert 'Major Outage (was :ok: Operational)' in cards[0]['body']
+    plugin.poll_components()
+    assert len(cards) == 2
+
+
+def test_inci_show_unavailable():
+    """Test incident shown from incident index while Cachet is down"""
+    def unavailable(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("Cachet is down")
+
+    bot = SimpleNamespace(repo_manager=SimpleNamespace(plugin_dir='.'),
+                          mode='text')
+    plugin = Cachet(bot, 'Cachet')
+    plugin.config = dict(CONFIG_DEFAULTS)
+    plugin._cache = SnapshotCache(ttl=60)
+    plugin._fetch_components = lambda: []
+    plugin._executor = ThreadPoolExecutor(max_workers=2)
+    plugin._updates = MutationQueue(plugin._executor, unavailable)
+    plugin._incident_index = IncidentIndex()
+    plugin._incident_index.upsert(Incident.from_api({
+        'id': 5, 'name': 'NAS failure', 'status': 1, 'message': 'Slow',
+        'created_at': '2017-01-01 10:00:00'}))
+    plugin.get_incident = unavailable
+    plugin.cachet_version = lambda: (0, 0)
+    cards = []
+    plugin.send_card = lambda **card: cards.append(card)
+
+    list(plugin.cachet_inci_show(SimpleNamespace(), '5'))
+    assert 'Cachet is unavailable, data as of' in cards[0]['body']
+    with pytest.raises(requests.exceptions.ConnectionError):
+        list(plugin.cachet_inci_show(SimpleNamespace(), '6'))
+
+
+def test_chunk_lines():
+    """Test card body chunking at line boundaries"""
+    lines = ['a' * 4, 'b' * 4, 'c' * 12, 'd']
+    assert list(chunk_lines(lines, 10)) == [
+        'aaaa\nbbbb', 'c' * 10, 'cc\nd']
+    assert list(chunk_lines(iter(['a', 'b']), 10)) == ['a\nb']
+    assert list(chunk_lines([], 10)) == []
+
+
+def test_parse_period():
+    """Test dates and periods parsing"""
+    day = parse_date('2017-07-21')
+    assert parse_date('2017-07-21 01:30') == day + 5400
+    assert parse_date('2017-07-21T01:30:10') == day + 5410
+    assert parse_date('21/07/2017') is None
+    assert parse_period('2017-07-21>') == (day, None)
+    assert parse_period('>2017-07-21') == (None, day + 86399)
+    assert parse_period('2017-07-21>2017-07-21 12:00') == (day,
+                                                           day + 43200)
+    with pytest.raises(ValueError):
+        parse_period('2017-07-21')
+
+
+def test_parse_targets():
+    """Test components targets specification parsing"""
+    ids, ranges, groups, patterns = parse_targets('1,3-5, g:2,^dns')
+    assert ids == {1}
+    assert ranges == [(3, 5)]
+    assert groups == {2}
+    assert [regex.pattern for regex in patterns] == ['^dns']
+    with pytest.raises(ValueError):
+        parse_targets('5-3')
+    with pytest.raises(ValueError):
+        parse_targets('1-999999999', max_span=100)
+
+
+def test_status_resolver():
+    """Test status aliases resolution"""
+    assert INCIDENT_STATUS.resolve('inv') == (1, "Investigating")
+    assert INCIDENT_STATUS.resolve('IDENTIFIED') == (2, "Identified")
+    assert INCIDENT_STATUS.resolve('in') is None
+    assert INCIDENT_STATUS.resolve('fixedx') is None
+    assert COMPONENT_STATUS.resolve('Partial Outage') == (3, "Partial Outage")
+    assert COMPONENT_STATUS.resolve('majoroutage') == (4, "Major Outage")
+    assert COMPONENT_STATUS.resolve('po') == (3, "Partial Outage")
+    assert COMPONENT_STATUS.resolve('2') == (2, "Performance Issues")
+    assert COMPONENT_STATUS.resolve('oper') is None
+    resolver = COMPONENT_STATUS.extend({'down': 'mo', 'ok': 1})
+    assert resolver.resolve('Down') == (4, "Major Outage")
+    assert resolver.resolve('ok') == (1, "Operational")
+    assert COMPONENT_STATUS.resolve('down') is None
+    with pytest.raises(ValueError):
+        COMPONENT_STATUS.extend({'down': 'broken'})
+
+
+def test_stats():
+    """Test commands and API calls statistics"""
+    url = 'https://status/api/v1/incidents/12?page=2'
+    assert endpoint_name('GET', url) == 'GET incidents/:id'
+    stats = Stats()
+    stats.observe_command('comp_show', 0.02)
+    stats.observe_command('comp_show', 0.2, error=True)
+    stats.observe_request('GET components', 0.003, received=2048)
+    report = "\n".join(stats.report())
+    assert '`comp_show`  2 calls, 1 errors' in report
+    assert '2.0 KiB received' in report
+    metric = 'cachet_command_duration_seconds_count{command="comp_show"} 2'
+    assert metric in stats.prometheus()
+
+
 def test_cachet_plugin_configuration(testbot):
     """Test the cachet_plugin_configuration command"""
     testbot.push_message('!plugin config Cachet %s' % str(ONLY_ENDPOINT))
@@ -48,6 +685,16 @@ def test_cachet_plugin_version(testbot):
     assert "Cachet plugin version:" in testbot.pop_message()
 
 
+def test_cachet_plugin_stats(testbot):
+    """Test the cachet_plugin_stats command"""
+    testbot.push_message('!cachet plugin version')
+    testbot.pop_message()
+    testbot.push_message('!cachet plugin stats')
+    assert "`plugin_version`  1 calls" in testbot.pop_message()
+    testbot.push_message('!cachet plugin stats --prometheus')
+    assert "cachet_command_duration_seconds" in testbot.pop_message()
+
+
 def test_cachet_comp_status(testbot):
     """Test the cachet_comp_status command"""
     testbot.push_message('!cachet comp status')
@@ -70,6 +717,14 @@ def test_cachet_comp_list_group(testbot):
     """Test the cachet_comp_list_group command"""
     testbot.push_message('!cachet comp list group 1')
     assert 'Group: 1' in testbot.pop_message()
+    testbot.push_message('!cachet comp list group 999999')
+    assert 'Unknown group id 999999' in testbot.pop_message()
+
+
+def test_cachet_group_status(testbot):
+    """Test the cachet_group_status command"""
+    testbot.push_message('!cachet group status')
+    assert 'Groups status:' in testbot.pop_message()
 
 
 def test_cachet_comp_show(testbot):
@@ -82,8 +737,10 @@ def test_cachet_comp_show(testbot):
 
 def test_cachet_comp_search(testbot):
     """Test the cachet_comp_search command"""
-    testbot.push_message('!cachet comp search test')
-    assert 'Strong the unimplementation' in testbot.pop_message()
+    testbot.push_message('!cachet comp search unknown')
+    assert 'No component found' in testbot.pop_message()
+    testbot.push_message('!cachet comp search comp')
+    assert 'Component A' in testbot.pop_message()
 
 
 def test_cachet_comp_set_status(testbot):
@@ -94,6 +751,18 @@ def test_cachet_comp_set_status(testbot):
     assert 'Component 1 status has been set' in testbot.pop_message()
 
 
+def test_cachet_comp_bulk_set_status(testbot):
+    """Test the cachet_comp_bulk_set_status command"""
+    testbot.push_message('!cachet comp bulk set status 1-2 unknown')
+    assert 'Unknown component status: unknown' in testbot.pop_message()
+    testbot.push_message('!cachet comp bulk set status unknown op')
+    assert 'No component matching: unknown' in testbot.pop_message()
+    testbot.push_message('!cachet comp bulk set status 1-2,9999 op')
+    assert 'unknown component' in testbot.pop_message()
+    testbot.push_message('!cachet comp bulk set status 1-999999999 op')
+    assert 'Invalid components range' in testbot.pop_message()
+
+
 def test_cachet_maint_forecast(testbot):
     """Test the cachet_maint_forecast command"""
     testbot.push_message('!cachet maint forecast --num 0')
@@ -120,6 +789,10 @@ def test_cachet_inci_last(testbot):
     """Test the cachet_inci_last command"""
     testbot.push_message('!cachet inci last')
     assert 'Last incidents:' in testbot.pop_message()
+    testbot.push_message('!cachet inci last --period 2017-01-01>')
+    assert 'Last incidents:' in testbot.pop_message()
+    testbot.push_message('!cachet inci last --period 2017')
+    assert 'Invalid period' in testbot.pop_message()
 
 
 def test_cachet_inci_show(testbot):
@@ -128,6 +801,8 @@ def test_cachet_inci_show(testbot):
     assert 'Unknown incident number 999999' in testbot.pop_message()
     testbot.push_message('!cachet inci show 1')
     assert 'Incident status:' in testbot.pop_message()
+    testbot.push_message('!cachet inci show 1 --num 1 --page 2')
+    assert 'Updates' in testbot.pop_message()
 
 
 def test_cachet_inci_new(testbot):
@@ -174,8 +849,12 @@ def test_cachet_inci_update(testbot):
 
 def test_cachet_inci_search(testbot):
     """Test the cachet_inci_search command"""
-    testbot.push_message("!cachet inci search test")
-    assert "not implemented." in testbot.pop_message()
+    testbot.push_message("!cachet inci search unknown")
+    assert "No incident found" in testbot.pop_message()
+    testbot.push_message("!cachet inci search 'incident [0-9]'")
+    assert "Matching incidents:" in testbot.pop_message()
+    testbot.push_message("!cachet inci search incident")
+    assert "Incident 1" in testbot.pop_message()
 
 
 def test_cachet_inci_set_component(testbot):